@@ -0,0 +1,124 @@
+"""Offline benchmarks of CastorApi against the local mock server.
+
+USAGE:
+python benchmarks/benchmark.py --records 500 --fields 50 --latency 0.02
+
+Measures wall time, number of requests, throughput and (with --memory)
+peak python memory of records_reports_all, the export functions and
+pagination, for a synthetic study served by tests/mock_castor.py. Memory
+tracing slows down python code, so timings are only comparable between runs
+with the same --memory setting.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from castorapi.castorapi import CastorApi
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'tests'))
+from mock_castor import MockStudy, MockCastorServer  # noqa: E402
+
+
+def measure(name, server, function, items=None, memory=False):
+    server.reset_counts()
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1024. ** 2
+        tracemalloc.stop()
+    if items is not None:
+        items = items(result)
+    return {'benchmark': name, 'seconds': elapsed,
+            'requests': server.request_count,
+            'requests/s': server.request_count / elapsed,
+            'ms/request': 1000. * elapsed / max(1, server.request_count),
+            'items/s': items / elapsed if items else None,
+            'MB sent': server.bytes_sent / 1024. ** 2,
+            'peak MB': peak}
+
+
+def run(args):
+    study = MockStudy(n_records=args.records, n_fields=args.fields,
+                      n_report_fields=args.report_fields)
+    results = []
+
+    def measure_(name, function, items=None):
+        return measure(name, server, function, items, memory=args.memory)
+
+    with MockCastorServer(study, latency=args.latency,
+                          page_size=args.page_size) as server:
+        def client(**kwargs):
+            return CastorApi(client_id='client', client_secret='secret',
+                             base_url=server.url,
+                             pool_size=max(10, args.workers), **kwargs)
+
+        study_id = study.study_id
+        serial = client(page_workers=1)
+        concurrent = client(page_workers=args.workers)
+
+        def n_points(frames):
+            return int(frames[0].notna().sum().sum())
+
+        results.append(measure_(
+            'records_reports_all (serial)',
+            lambda: serial.records_reports_all(study_id, bulk=False),
+            n_points))
+        results.append(measure_(
+            'records_reports_all (%d workers)' % args.workers,
+            lambda: concurrent.records_reports_all(
+                study_id, max_workers=args.workers, bulk=False), n_points))
+        results.append(measure_(
+            'records_reports_all (bulk)',
+            lambda: concurrent.records_reports_all(study_id), n_points))
+        results.append(measure_(
+            'request_study_export_data',
+            lambda: serial.request_study_export_data(study_id), len))
+        results.append(measure_(
+            'iter_study_export_data',
+            lambda: sum(len(chunk) for chunk in
+                        serial.iter_study_export_data(study_id,
+                                                      chunksize=10000)),
+            lambda rows: rows))
+        results.append(measure_(
+            'request_study_records (serial pages)',
+            lambda: serial.request_study_records(study_id), len))
+        results.append(measure_(
+            'request_study_records (%d page workers)' % args.workers,
+            lambda: concurrent.request_study_records(study_id), len))
+        results.append(measure_(
+            'iter_study_records',
+            lambda: sum(1 for r in concurrent.iter_study_records(study_id)),
+            lambda n: n))
+    return results
+
+
+def print_results(results):
+    columns = ['seconds', 'requests', 'requests/s', 'ms/request', 'items/s',
+               'MB sent', 'peak MB']
+    width = max(len(r['benchmark']) for r in results)
+    print('benchmark'.ljust(width) + ''.join(c.rjust(12) for c in columns))
+    for r in results:
+        print(r['benchmark'].ljust(width) + ''.join(
+            ('-' if r[c] is None else '%.3f' % r[c]
+             if isinstance(r[c], float) else str(r[c])).rjust(12)
+            for c in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--records', type=int, default=200)
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--report-fields', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='seconds added to every request')
+    parser.add_argument('--page-size', type=int, default=25)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--memory', action='store_true',
+                        help='measure peak memory (slower)')
+    print_results(run(parser.parse_args()))
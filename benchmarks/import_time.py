@@ -0,0 +1,73 @@
+"""Startup time of short-lived scripts that use castorapi.
+
+USAGE:
+python benchmarks/import_time.py --repeat 10
+
+Measures, in fresh python processes, the time to import castorapi and the
+time of a short job (token, study and records requests against the local
+mock server), and which of the optional modules (pandas, progressbar,
+asyncio, httpx) were imported.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'tests'))
+from mock_castor import MockStudy, MockCastorServer  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+IMPORT = '''
+import time
+start = time.perf_counter()
+import castorapi
+seconds = time.perf_counter() - start
+'''
+
+JOB = '''
+import time
+start = time.perf_counter()
+from castorapi import CastorApi
+c = CastorApi(client_id='client', client_secret='secret', base_url=%r)
+c.request_study(%r)
+c.request_study_records(%r)
+seconds = time.perf_counter() - start
+'''
+
+REPORT = '''
+import sys
+print(seconds, ','.join(m for m in ['pandas', 'progressbar', 'asyncio',
+                                   'httpx'] if m in sys.modules))
+'''
+
+
+def run(code, repeat):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code + REPORT],
+                                env=env, check=True, capture_output=True,
+                                text=True).stdout.split()
+        times.append(float(output[0]))
+    return times, output[1] if len(output) > 1 else '-'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    with MockCastorServer(MockStudy(n_records=20)) as server:
+        study_id = server.study.study_id
+        benchmarks = [('import castorapi', IMPORT),
+                      ('token + study + records',
+                       JOB % (server.url, study_id, study_id))]
+        print('benchmark'.ljust(26) + 'min ms'.rjust(10) +
+              'median ms'.rjust(12) + '   imported')
+        for name, code in benchmarks:
+            times, imported = run(code, args.repeat)
+            print(name.ljust(26) + ('%.1f' % (1000 * min(times))).rjust(10)
+                  + ('%.1f' % (1000 * statistics.median(times))).rjust(12)
+                  + '   ' + imported)
@@ -0,0 +1,90 @@
+"""Parse time of JSON pages with the available decoders.
+
+USAGE:
+python benchmarks/json_decode.py --page-size 1000 --pages 20
+
+Builds pages of study data points (with their HAL _links) of a synthetic
+study from tests/mock_castor.py, as the Castor API returns them, and times
+parsing each page with response.json() (the previous path: bytes are
+decoded to str first) and with the decoders of get_json_decoder on the
+raw bytes.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import requests
+from castorapi.castorapi import get_json_decoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'tests'))
+from mock_castor import MockStudy  # noqa: E402
+
+
+def pages(study, page_size, n_pages):
+    points = [p for r in study.records for p in study.study_points[
+        r['record_id']]][:page_size * n_pages]
+    for page in range(len(points) // page_size):
+        yield json.dumps({
+            '_links': {'self': {'href': 'https://data.castoredc.com/api/...'}},
+            '_embedded': {'items': points[page * page_size:
+                                          (page + 1) * page_size]},
+            'page_count': n_pages, 'page_size': page_size,
+            'total_items': len(points), 'page': page + 1}).encode('utf-8')
+
+
+def response(content):
+    result = requests.Response()
+    result._content = content
+    result.status_code = 200
+    result.headers['Content-Type'] = 'application/hal+json'
+    result.encoding = None  # as for a Castor response without a charset
+    return result
+
+
+def measure(function, contents, repeat):
+    times = []
+    for content in contents:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(content)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+    return statistics.median(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    n_fields = 50
+    study = MockStudy(n_records=args.page_size * args.pages // 40 + 1,
+                      n_fields=n_fields, n_report_fields=0)
+    contents = list(pages(study, args.page_size, args.pages))
+    print(str(len(contents)) + ' pages of ' + str(args.page_size) +
+          ' data points, ' + str(round(statistics.mean(
+              len(c) for c in contents) / 1024)) + ' KB per page')
+
+    decoders = [('response.json()',
+                 lambda content: response(content).json())]
+    for name in ['json', 'orjson']:
+        try:
+            decoders.append((name + '.loads(bytes)', get_json_decoder(name)))
+        except ImportError:
+            print(name + ' is not installed')
+    reference = None
+    print('decoder'.ljust(24) + 'ms/page'.rjust(10) + 'MB/s'.rjust(10) +
+          'speedup'.rjust(10))
+    for name, decoder in decoders:
+        seconds = measure(decoder, contents, args.repeat)
+        reference = reference or seconds
+        print(name.ljust(24) + ('%.2f' % (1000 * seconds)).rjust(10) +
+              ('%.0f' % (statistics.mean(len(c) for c in contents) /
+                         seconds / 1024 ** 2)).rjust(10) +
+              ('%.2f' % (reference / seconds)).rjust(10))
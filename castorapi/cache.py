@@ -0,0 +1,129 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """In-memory LRU cache for API responses.
+
+    USAGE:
+    from castorapi.cache import MemoryCache
+    c = CastorApi('/path/to/folder/with/secret_client',
+                  cache=MemoryCache(max_bytes=64 * 1024 ** 2))
+
+    Entries are dicts with the response 'content' (bytes), 'headers' (dict)
+    and 'expires' (unix time). When more than max_bytes of content is
+    stored, the least recently used entries are evicted.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key)['content'])
+            self._entries[key] = entry
+            self._size += len(entry['content'])
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted['content'])
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key)['content'])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class SqliteCache:
+    """On-disk cache for API responses, stored in a sqlite database.
+
+    USAGE:
+    from castorapi.cache import SqliteCache
+    c = CastorApi('/path/to/folder/with/secret_client',
+                  cache=SqliteCache('/path/to/castor_cache.sqlite'))
+
+    The cache survives between runs, so repeated (nightly) jobs can skip
+    requests for study metadata. When more than max_bytes of content is
+    stored, the least recently used entries are evicted.
+
+    NOTE:
+    # The cache contains study data; store it in a private folder and do not
+      share it between accounts with different access rights.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 ** 2):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, content BLOB, headers TEXT, '
+                'expires REAL, size INTEGER, accessed REAL)')
+
+    def get(self, key):
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT content, headers, expires FROM responses '
+                'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?',
+                (time.time(), key))
+        return {'content': bytes(row[0]), 'headers': json.loads(row[1]),
+                'expires': row[2]}
+
+    def set(self, key, entry):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(key, content, headers, expires, size, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, entry['content'], json.dumps(entry['headers']),
+                 entry['expires'], len(entry['content']), time.time()))
+            size = self._connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            rows = self._connection.execute(
+                'SELECT key, size FROM responses WHERE key != ? '
+                'ORDER BY accessed', (key,))
+            evict = []
+            for evict_key, evict_size in rows:
+                if size <= self.max_bytes:
+                    break
+                evict.append((evict_key,))
+                size -= evict_size
+            self._connection.executemany(
+                'DELETE FROM responses WHERE key = ?', evict)
+
+    def delete(self, key):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM responses WHERE key = ?',
+                                     (key,))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM responses')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
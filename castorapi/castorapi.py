@@ -1,10 +1,44 @@
+import array
+import copy
+import email.utils
+import functools
+import importlib
 import io
 import json
 import os.path
-import pandas as pd
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import requests
-import progressbar
+import urllib3
 import logging
+from castorapi.checkpoint import RecordCheckpoint
+
+
+class _LazyModule:
+    # a module that is imported when it is first used. pandas (and
+    # progressbar, asyncio, httpx) are only needed for the DataFrame
+    # helpers, exports and AsyncCastorApi; scripts that only do JSON
+    # requests do not pay for importing them.
+    def __init__(self, name):
+        self._name = name
+        self._module = sys.modules.get(name)
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+pd = _LazyModule('pandas')
+progressbar = _LazyModule('progressbar')
+asyncio = _LazyModule('asyncio')
+httpx = _LazyModule('httpx')
 
 
 def process_table(txt):
@@ -15,6 +49,572 @@ def process_table(txt):
     return data
 
 
+# columns of the data points that are used to build the study and report
+# frames in CastorApi.records_reports_all
+STUDY_DATA_COLUMNS = ['record_id', 'field_id', 'field_value']
+REPORT_DATA_COLUMNS = ['record_id', 'report_instance_id', 'field_id',
+                       'field_value']
+
+
+# columns of the data points that hold ids; these repeat for every data
+# point, so one str per distinct id is kept (see _extend_columns)
+ID_COLUMNS = ['record_id', 'field_id', 'report_instance_id']
+
+
+def _extend_columns(columns, data_points, interned=None):
+    # append the data points (dicts) to a dict of column lists. With a dict
+    # `interned`, equal ids share one str object instead of one per data
+    # point (the data points themselves, with their _links, are not kept).
+    for key, values in columns.items():
+        if interned is not None and key in ID_COLUMNS:
+            values.extend([interned.setdefault(v, v) for v in
+                           [d.get(key) for d in data_points]])
+        else:
+            values.extend([d.get(key) for d in data_points])
+
+
+def _long_to_wide(index, columns, values, names, join_duplicates=False):
+    # Reshape long data (index labels, column labels, values) to a wide
+    # frame, sorted on index and columns like pd.pivot. Duplicate entries are
+    # joined with ', ' (join_duplicates) or the last value is used.
+    keys = pd.MultiIndex.from_arrays(list(index) + [columns], names=names)
+    if isinstance(values, pd.Series):
+        values = values.array  # do not align on the index of values
+    series = pd.Series(values, index=keys)
+    if keys.has_duplicates:
+        if join_duplicates:
+            series = series.groupby(level=list(range(len(names))),
+                                    sort=False).agg(', '.join)
+        else:
+            series = series[~keys.duplicated(keep='last')]
+    return series.unstack(level=-1)
+
+
+# Castor field types and how their values are cast by cast_field_types
+NUMERIC_FIELD_TYPES = ['numeric', 'slider', 'year']
+OPTION_FIELD_TYPES = ['radio', 'dropdown']
+DATE_FIELD_FORMATS = {'date': '%d-%m-%Y', 'datetime': '%d-%m-%Y;%H:%M'}
+
+# columns of the export data with few unique values
+EXPORT_CATEGORICAL_COLUMNS = ['Study ID', 'Record ID', 'Form Type',
+                              'Form Instance ID', 'Form Instance Name',
+                              'Field ID', 'User ID']
+
+
+def cast_field_types(data, structure, optiongroups):
+    """
+    Cast the columns of a (wide) data frame to the type of their field.
+
+    Numeric fields become numbers, date fields datetime64 and single choice
+    option fields (radio, dropdown) a pandas Categorical with the option
+    values of their option group as categories. Other columns and values
+    that cannot be cast (which become NaN/NaT) are left as is.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Data with a column per field variable name, e.g. df_study from
+        CastorApi.records_reports_all.
+    structure : DataFrame
+        Study structure, see CastorApi.request_study_export_structure.
+    optiongroups : DataFrame
+        Option groups, see CastorApi.request_study_export_optiongroups.
+
+    Returns
+    -------
+    DataFrame
+        A copy of data with typed columns.
+    """
+    data = data.copy()
+    field_types = dict(zip(structure['Field Variable Name'],
+                           structure['Field Type']))
+    field_optiongroups = dict(zip(structure['Field Variable Name'],
+                                  structure['Field Option Group']))
+    options = {group_id: list(group['Option Value'].drop_duplicates())
+               for group_id, group in
+               optiongroups.groupby('Option Group Id', sort=False)}
+    for column in data.columns:
+        field_type = field_types.get(column)
+        if field_type in NUMERIC_FIELD_TYPES:
+            data[column] = pd.to_numeric(data[column], errors='coerce')
+        elif field_type in DATE_FIELD_FORMATS:
+            data[column] = pd.to_datetime(
+                data[column], format=DATE_FIELD_FORMATS[field_type],
+                errors='coerce')
+        elif field_type in OPTION_FIELD_TYPES and \
+                field_optiongroups.get(column) in options:
+            data[column] = pd.Categorical(
+                data[column],
+                categories=options[field_optiongroups[column]])
+    return data
+
+
+def _report_names(df_report, df_structure_report):
+    # the report (form collection) of each report instance: the report with
+    # the most values in the row
+    reports = df_structure_report.drop_duplicates('Field Variable Name')
+    reports = reports[reports['Field Variable Name'].isin(df_report.columns)]
+    membership = pd.crosstab(reports['Field Variable Name'],
+                             reports['Form Collection Name'])
+    if membership.empty:
+        return pd.Series(None, index=df_report.index, dtype='object')
+    counts = df_report[membership.index].notna().astype(int).to_numpy() \
+        @ membership.to_numpy()
+    names = membership.columns.to_numpy()[counts.argmax(axis=1)]
+    return pd.Series(names, index=df_report.index).where(
+        counts.max(axis=1) > 0)
+
+
+def write_records_reports(frames, folder, file_format='parquet',
+                          partition=True):
+    """
+    Write the frames of CastorApi.records_reports_all to columnar datasets.
+
+    Creates in folder:
+        study/     df_study, partitioned by institute (hospital=<name>/)
+        report/    df_report, partitioned by report (report=<name>/)
+        structure_study, structure_report and optiongroups files
+    Categorical columns (option fields when typed=True) are stored
+    dictionary-encoded. Read the data back with e.g.
+    pd.read_parquet(folder + '/study', columns=['Record Id', 'pat_sex'],
+    filters=[('hospital', '=', 'AMC')]) or pyarrow.dataset.dataset().
+
+    Parameters
+    ----------
+    frames : tuple
+        Result of records_reports_all; typed=True is recommended and
+        add_including_center=True is needed to partition by institute.
+    folder : STR
+        Output folder. The datasets in it must not exist yet.
+    file_format : STR, optional
+        'parquet' (default) or 'feather' (Arrow IPC, can be memory mapped).
+    partition : BOOL, optional
+        Partition the study data by institute and the report data by
+        report. The default is True.
+
+    Returns
+    -------
+    folder
+
+    NOTE:
+    # Requires the pyarrow package (pip install pyarrow).
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('write_records_reports requires the pyarrow '
+                          + 'package')
+    if file_format not in ['parquet', 'feather']:
+        raise NameError('file_format should be \'parquet\' or \'feather\'')
+    df_study, df_structure_study, df_report, df_structure_report, \
+        df_optiongroups_structure = frames
+    extension = '.' + file_format
+
+    def write(df, name, partition_column=None):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        partitioning = None
+        if partition_column is not None:
+            partitioning = ds.partitioning(
+                pa.schema([table.schema.field(partition_column)]),
+                flavor='hive')
+        ds.write_dataset(table, os.path.join(folder, name),
+                         format='ipc' if file_format == 'feather'
+                         else file_format,
+                         partitioning=partitioning,
+                         basename_template='part-{i}' + extension)
+
+    os.makedirs(folder, exist_ok=True)
+    write(df_study, 'study', 'hospital' if partition and
+          'hospital' in df_study.columns else None)
+    if not df_report.empty:
+        df_report = df_report.reset_index()
+        if partition:
+            df_report['report'] = _report_names(df_report,
+                                                df_structure_report)
+        write(df_report, 'report', 'report' if partition else None)
+    for df, name in [(df_structure_study, 'structure_study'),
+                     (df_structure_report, 'structure_report'),
+                     (df_optiongroups_structure, 'optiongroups')]:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if file_format == 'parquet':
+            pq.write_table(table, os.path.join(folder, name + extension))
+        else:
+            feather.write_feather(table,
+                                  os.path.join(folder, name + extension))
+    return folder
+
+
+# time-to-live (seconds) of cached responses, by endpoint (regular expression
+# on the request path). Only used when CastorApi is given a cache; endpoints
+# that do not match are never cached. Study metadata rarely changes.
+CACHE_TTL = {
+    r'/study/[^/]+/field(/[^/?]+)?(\?|$)': 24 * 3600,
+    r'/study/[^/]+/field-optiongroup(/[^/?]+)?(\?|$)': 24 * 3600,
+    r'/study/[^/]+/export/(structure|optiongroups)(\?|$)': 24 * 3600,
+    r'/study/[^/]+/report(/[^/?]+)?(\?|$)': 24 * 3600,
+    r'/study/[^/]+/phase(/[^/?]+)?(\?|$)': 24 * 3600,
+    r'/study/[^/]+/step(/[^/?]+)?(\?|$)': 24 * 3600,
+}
+
+
+def _cached_response(entry, request_uri):
+    # rebuild a requests.Response from a cache entry
+    response = requests.Response()
+    response.status_code = 200
+    response._content = entry['content']
+    response.headers.update(entry['headers'])
+    response.url = request_uri
+    response.encoding = requests.utils.get_encoding_from_headers(
+        response.headers)
+    return response
+
+
+def _page_uris(next_uri, page, page_count):
+    # the uris of all pages after `page`, derived from the uri of the next
+    # page by replacing its page parameter
+    parts = urllib.parse.urlsplit(next_uri)
+    query = [(key, value) for key, value in urllib.parse.parse_qsl(
+        parts.query, keep_blank_values=True) if key != 'page']
+    return [urllib.parse.urlunsplit(parts._replace(
+        query=urllib.parse.urlencode(query + [('page', str(p))])))
+        for p in range(page + 1, page_count + 1)]
+
+
+# path segments that are followed by an id, used to group requests by
+# endpoint (e.g. /study/{id}/record/{id}) for the request hooks
+ENDPOINT_ID_SEGMENTS = {'study', 'record', 'field', 'field-optiongroup',
+                        'institute', 'report', 'report-instance', 'phase',
+                        'step', 'survey', 'survey-instance',
+                        'survey-package-instance', 'user', 'visit', 'country',
+                        'query', 'field-dependency', 'field-validation',
+                        'metadata', 'metadatatype'}
+
+
+def _endpoint(request_uri, api_path=''):
+    # the endpoint template of a request uri, without the query and the ids
+    path = urllib.parse.urlsplit(request_uri).path
+    if api_path and path.startswith(api_path):
+        path = path[len(api_path):]
+    segments = path.split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in ENDPOINT_ID_SEGMENTS and segments[i]:
+            segments[i] = '{id}'
+    return '/'.join(segments)
+
+
+def get_json_decoder(name='auto'):
+    """
+    A function that parses JSON from the bytes of a response.
+
+    Parameters
+    ----------
+    name : STR or callable, optional
+        'json': the standard library decoder. 'orjson': the (faster) orjson
+        package. 'auto' (default): orjson if it is installed, otherwise
+        the standard library. A callable is returned as is; it should parse
+        bytes (UTF-8) and str.
+
+    Returns
+    -------
+    callable
+    """
+    if callable(name):
+        return name
+    if name in ['auto', 'orjson']:
+        try:
+            import orjson
+            return orjson.loads
+        except ImportError:
+            if name == 'orjson':
+                raise ImportError('the orjson decoder requires the orjson '
+                                  + 'package')
+    if name in ['auto', 'json']:
+        return json.loads
+    raise NameError('unknown json decoder: ' + str(name))
+
+
+def _drop_links(data_points):
+    # data points without their (large) HAL links, e.g. to store them
+    return [{key: value for key, value in d.items() if key != '_links'}
+            for d in data_points]
+
+
+def _read_client_and_secret(folder):
+    # the client id and secret in the 'client' and 'secret' files of folder
+    def find_file(name):
+        return [file for file in os.listdir(folder) if name in file][0]
+    with open(os.path.join(folder, find_file('client')), 'r') as file:
+        client_id = file.read().rstrip()
+    with open(os.path.join(folder, find_file('secret')), 'r') as file:
+        client_secret = file.read().rstrip()
+    return client_id, client_secret
+
+
+def _add_query_parameter(request, key, value):
+    separator = '&' if '?' in request else '?'
+    return request + separator + key + '=' + str(value)
+
+
+class RateLimiter:
+    """Thread-safe token bucket that limits calls to `rate` per second.
+
+    USAGE:
+    limiter = RateLimiter(10, burst=5)
+    limiter.acquire()  # blocks until the next call is allowed
+
+    Up to `burst` calls are allowed at once after an idle period.
+    """
+
+    def __init__(self, rate, burst=1):
+        if not rate or rate <= 0:
+            raise NameError('rate should be a positive number of requests '
+                            + 'per second')
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # returns the time (seconds) the caller had to wait
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def _connection_not_established(error):
+    # True if the connection for a request could not be set up, so the
+    # request was never sent (connect timeout, refused, name not resolved)
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    causes = list(error.args[:1])
+    for _ in range(10):  # urllib3 MaxRetryError -> NewConnectionError
+        if not causes:
+            break
+        cause = causes.pop(0)
+        if isinstance(cause, urllib3.exceptions.NewConnectionError):
+            return True
+        if isinstance(cause, BaseException):
+            causes.extend(c for c in [getattr(cause, 'reason', None),
+                                      cause.__cause__] if c is not None)
+    return False
+
+
+class RetryPolicy:
+    """When and how long to wait before a failed request is retried.
+
+    USAGE:
+    c = CastorApi('/path/to/folder/with/secret_client',
+                  retry=RetryPolicy(max_retries=5, backoff_factor=1.))
+
+    NOTE:
+    # Retries on connection errors, timeouts and the statuses in
+      retry_statuses (429 Too Many Requests and 5xx), with exponential
+      backoff (backoff_factor * 2 ** attempt, at most max_backoff seconds)
+      and full jitter. A Retry-After header of the server is honoured, up
+      to max_backoff seconds.
+    # POST requests are not idempotent; they are only retried when the
+      server did not process them (429, or the connection could not be set
+      up), unless retry_post is True.
+    # Use RetryPolicy(max_retries=0) to disable retries.
+    """
+
+    def __init__(self, max_retries=3, backoff_factor=0.5, max_backoff=60.,
+                 jitter=True, retry_statuses=(429, 500, 502, 503, 504),
+                 retry_post=False):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = retry_statuses
+        self.retry_post = retry_post
+
+    def should_retry(self, method, response=None, error=None):
+        if error is not None:
+            if method == 'GET' or self.retry_post:
+                return isinstance(error, (requests.exceptions.ConnectionError,
+                                          requests.exceptions.Timeout))
+            # only when the connection could not be set up, i.e. the request
+            # was not sent. A connection that is lost later (e.g. 'Connection
+            # aborted') may have delivered the request to the server.
+            return _connection_not_established(error)
+        if response.status_code not in self.retry_statuses:
+            return False
+        return method == 'GET' or self.retry_post or \
+            response.status_code == 429
+
+    def delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') \
+            if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = None
+                date = email.utils.parsedate_tz(retry_after)
+                if date is not None:
+                    delay = email.utils.mktime_tz(date) - time.time()
+            if delay is not None:
+                return min(self.max_backoff, max(0., delay))
+        delay = min(self.max_backoff, self.backoff_factor * 2 ** attempt)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+class TokenManager:
+    """Fetches the Castor access token and refreshes it before it expires.
+
+    USAGE:
+    tokens = TokenManager('https://data.castoredc.com/oauth/token',
+                          client_id, client_secret, requests.Session())
+    headers = {'Authorization': 'Bearer ' + tokens.token}
+
+    NOTE:
+    # Safe to share between threads. While one thread refreshes the token,
+      the others keep using the current token as long as it is valid.
+    # A Castor token can usually be used for 18000 seconds (expires_in).
+      It is refreshed refresh_margin seconds before it expires.
+    """
+
+    def __init__(self, token_uri, client_id, client_secret, session,
+                 timeout=None, refresh_margin=300):
+        self.token_uri = token_uri
+        self.refresh_margin = refresh_margin
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._session = session
+        self._timeout = timeout
+        self._token = None
+        self._expires = 0
+        self._refresh_at = 0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def token(self):
+        now = time.monotonic()
+        if now < self._refresh_at:
+            return self._token
+        # only wait for a refresh by another thread if the token expired
+        if self._lock.acquire(blocking=now >= self._expires):
+            try:
+                if time.monotonic() >= self._refresh_at:
+                    self.__fetch()
+            finally:
+                self._lock.release()
+        return self._token
+
+    def refresh(self, rejected_token=None):
+        # rejected_token: the token that was rejected by the server (401);
+        # it is only replaced if no other thread replaced it already
+        with self._lock:
+            if rejected_token is None or rejected_token == self._token:
+                self.__fetch()
+        return self._token
+
+    def __fetch(self):
+        response_token = self._session.post(
+            self.token_uri,
+            data={'client_id': self._client_id,
+                  'client_secret': self._client_secret,
+                  'grant_type': 'client_credentials'},
+            timeout=self._timeout)
+        rd = json.loads(response_token.content)
+        # throw error if an error occurs.
+        if 'error' in rd:
+            raise NameError('error ' + rd['error'] + '\n'
+                            + rd['error_description'])
+        expires_in = float(rd.get('expires_in', 18000))
+        self._token = rd['access_token']
+        self._expires = time.monotonic() + expires_in
+        # refresh_margin before expiry, but not before half of its lifetime
+        self._refresh_at = time.monotonic() + max(
+            expires_in - self.refresh_margin, expires_in / 2)
+        logging.info('Castor access token fetched, valid for ' +
+                     str(expires_in) + ' seconds')
+
+
+class FieldIndex:
+    """Lookup tables for the fields of a study.
+
+    USAGE:
+    index = c.field_index()
+    index.field_id('pat_height')
+    index.variable_name('98BA8DDF-3E04-46A6-891A-0BDC555AE1A3')
+    index.optiongroup_id('pat_sex')
+    index.fields_by_optiongroup('<OPTIONGROUP_ID>')
+    index.fields_by_parent('<STEP_ID>')  # fields of a form/step
+
+    Built from one request_field(include='optiongroup') call, see
+    CastorApi.field_index.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self._by_id = {}
+        self._by_variable_name = {}
+        self._by_optiongroup = {}
+        self._by_parent = {}
+        for field in fields:
+            self._by_id[field['field_id']] = field
+            self._by_variable_name.setdefault(
+                field.get('field_variable_name'), []).append(field)
+            if field.get('option_group'):
+                self._by_optiongroup.setdefault(
+                    field['option_group']['id'], []).append(field)
+            if field.get('parent_id'):
+                self._by_parent.setdefault(
+                    field['parent_id'], []).append(field)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def field(self, field_id):
+        return self._by_id.get(field_id)
+
+    def fields_by_variable_name(self, variable_name):
+        # variable names are unique in Castor, except for fields without one
+        return self._by_variable_name.get(variable_name, [])
+
+    def field_id(self, variable_name):
+        fields = self.fields_by_variable_name(variable_name)
+        return fields[0]['field_id'] if fields else None
+
+    def variable_name(self, field_id):
+        field = self._by_id.get(field_id)
+        return field['field_variable_name'] if field else None
+
+    def optiongroup_id(self, variable_name):
+        fields = self.fields_by_variable_name(variable_name)
+        if len(fields) == 1 and fields[0].get('option_group'):
+            return fields[0]['option_group']['id']
+        return None
+
+    def fields_by_optiongroup(self, optiongroup_id):
+        return self._by_optiongroup.get(optiongroup_id, [])
+
+    def fields_by_parent(self, parent_id):
+        return self._by_parent.get(parent_id, [])
+
+    def variable_names(self):
+        # {field_id: field_variable_name}
+        return {field_id: field['field_variable_name']
+                for field_id, field in self._by_id.items()}
+
+
 class CastorApi:
     """CastorApi class
     USAGE:
@@ -37,57 +637,138 @@ class CastorApi:
     """
     # FIXME: ADD POST METHODS and POST API ENDPOINTS
     # FIXME: ADD PATCH METHODS and PATCH API ENDPOINTS
-    # FIXME: ENABLE MULTIPLE FIELD UPDATES FOR POST API ENDPOINTS
 
     # define URLs for API
     _base_url = 'https://data.castoredc.com'
     _token_path = '/oauth/token'
     _api_request_path = '/api'
 
-    _token = None
+    # access token, refreshed before it expires (see TokenManager)
+    _token_manager = None
+
+    # HTTP session (connection pool) shared by all requests of an instance
+    _session = None
+    _timeout = None
+
+    # retries of failed requests and client-side rate limit (requests per
+    # second) for all requests of an instance
+    retry = None
+    _rate_limiter = None
+
+    # maximum number of requests in flight at the same time for all threads
+    # that use an instance (None: no limit)
+    _request_slots = None
+
+    # number of requests, retries and waits for the rate limit
+    counters = None
+
+    # callables that are called with a dict describing every request (see
+    # __notify and castorapi.metrics)
+    hooks = None
+
+    # pagination: number of items per page (None: Castor default) and the
+    # number of pages that are fetched concurrently
+    page_size = None
+    page_workers = 4
+
+    # page size of the study-level data point collections (the data points
+    # of all records), so a study needs a handful of requests
+    bulk_page_size = 1000
+
+    # function that parses the JSON responses, see get_json_decoder
+    json_decoder = None
+
+    # share the response of a GET request with the threads that request the
+    # same URL while it is in flight (see __request_json_get)
+    coalesce = True
+    _in_flight = None
+
+    # optional response cache (see castorapi.cache) and its time-to-live
+    # per endpoint (see CACHE_TTL)
+    cache = None
+    cache_ttl = None
 
     # make it more convenient for the user by saving the last used ID's within
     # the class instance
     __study_id_saved = None
 
+    # FieldIndex per study_id, see field_index()
+    _field_indexes = None
+
     # set to True when debugging and limiting the # records fetched to 25
     # (for Castor_api.records_reports_all())
     debug_mode = False
 
     def __init__(self, folder_with_client_and_secret=None,
                  client_id=None,
-                 client_secret=None):
+                 client_secret=None,
+                 pool_size=10,
+                 timeout=None,
+                 session=None,
+                 page_size=None,
+                 page_workers=4,
+                 cache=None,
+                 cache_ttl=None,
+                 retry=None,
+                 max_requests_per_second=None,
+                 base_url=None,
+                 hooks=None,
+                 coalesce=True,
+                 max_concurrent_requests=None,
+                 json_decoder='auto'):
+        # base_url: e.g. another Castor server or a local (mock) server
+        if base_url is not None:
+            self._base_url = base_url
+        # all requests go through one session, so TCP/TLS connections are
+        # kept alive and reused. Use a pool_size of at least the number of
+        # concurrent workers (e.g. max_workers in records_reports_all).
+        # A custom (requests compatible) session can be provided to use a
+        # different transport adapter, e.g. one with HTTP/2 support.
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self._session = session
+        self._timeout = timeout
+        self.page_size = page_size
+        self.page_workers = page_workers
+        # cache_ttl extends or overrides CACHE_TTL (its patterns are matched
+        # first), use a ttl of 0 to disable caching of an endpoint
+        self.cache = cache
+        self.cache_ttl = dict(cache_ttl or {})
+        for pattern, ttl in CACHE_TTL.items():
+            self.cache_ttl.setdefault(pattern, ttl)
+        self.retry = retry if retry is not None else RetryPolicy()
+        if max_requests_per_second:
+            self._rate_limiter = RateLimiter(max_requests_per_second)
+        if max_concurrent_requests:
+            self._request_slots = threading.BoundedSemaphore(
+                max_concurrent_requests)
+        self.counters = {'requests': 0, 'retries': 0, 'throttle_waits': 0,
+                         'throttle_wait_time': 0., 'coalesced': 0}
+        self._counters_lock = threading.Lock()
+        self.hooks = list(hooks or [])
+        self.coalesce = coalesce
+        self.json_decoder = get_json_decoder(json_decoder)
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._field_indexes = {}
+        self._field_indexes_lock = threading.Lock()
         if folder_with_client_and_secret is not None:
             if os.path.isdir(folder_with_client_and_secret):
                 # load client id & secret for current user from folder
-                def find_file(name):
-                    return [file for file in os.listdir(
-                        folder_with_client_and_secret) if name in file][0]
-                with open(os.path.join(folder_with_client_and_secret,
-                                       find_file('client')), 'r') as file:
-                    client_id = file.read().rstrip()
-                with open(os.path.join(folder_with_client_and_secret,
-                                       find_file('secret')), 'r') as file:
-                    client_secret = file.read().rstrip()
+                client_id, client_secret = _read_client_and_secret(
+                    folder_with_client_and_secret)
         if client_id is not None and client_secret is not None:
             # using the client and secret, get an access token
             # this castor api token can usually be used for up to 18000
-            # seconds, after which it stops working (and could theoretically
-            # be refreshed, but this is not documented in the Castor api:
-            # data.castoredc.com/api)
-            response_token = requests.post(self._base_url+self._token_path,
-                                           data={'client_id':
-                                                 client_id,
-                                                 'client_secret':
-                                                     client_secret,
-                                                 'grant_type':
-                                                     'client_credentials'})
-            rd = json.loads(response_token.text)
-            # throw error if an error occurs.
-            if 'error' in rd:
-                raise NameError('error ' + rd['error'] + '\n'
-                                + rd['error_description'])
-            self._token = rd['access_token']
+            # seconds; the token manager fetches a new token before it
+            # expires (and when the server rejects it)
+            self._token_manager = TokenManager(
+                self._base_url+self._token_path, client_id, client_secret,
+                self._session, timeout=self._timeout)
         else:
             raise NameError(
                 'castor_api expects either 1 input argument; a folder with'
@@ -97,40 +778,195 @@ class CastorApi:
                 + 'Or use these 2 input arguments: '
                 + 'client_id and client_secret')
 
-    def __request_get(self, request):
+    @property
+    def _token(self):
+        return self._token_manager.token
+
+    def __count(self, counter, value=1):
+        with self._counters_lock:
+            self.counters[counter] += value
+
+    def __notify(self, method, request_uri, response, error, start, seconds,
+                 attempt=0, cache_hit=False, stream=False, data=None):
+        # call the hooks with a description of the request:
+        # method, endpoint (e.g. '/study/{id}/record'), uri, status (None on
+        # a connection error), error, start (unix time), seconds (until the
+        # response headers when streaming), bytes_sent, bytes_received
+        # (Content-Length when streaming), attempt (0 for the first try of a
+        # request, 1 for the first retry, etc.) and cache_hit
+        bytes_received = 0
+        if response is not None:
+            if stream:
+                bytes_received = int(response.headers.get('Content-Length',
+                                                          0))
+            else:
+                bytes_received = len(response.content)
+        event = {'method': method,
+                 'endpoint': _endpoint(request_uri, self._api_request_path),
+                 'uri': request_uri,
+                 'status': response.status_code if response is not None
+                 else None,
+                 'error': error,
+                 'start': start,
+                 'seconds': seconds,
+                 'bytes_sent': len(data) if data else 0,
+                 'bytes_received': bytes_received,
+                 'attempt': attempt,
+                 'cache_hit': cache_hit}
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as err:
+                logging.warning('Request hook failed: %s', err)
+
+    def __send(self, method, request_uri, headers=None, **kwargs):
+        # send a request with the access token. If the token is rejected
+        # (401), e.g. because it expired, refresh it and try once more.
+        # Transient errors are retried according to the retry policy.
+        token_refreshed = False
+        attempt = 0
+        while True:
+            if self._rate_limiter is not None:
+                wait = self._rate_limiter.acquire()
+                if wait > 0:
+                    self.__count('throttle_waits')
+                    self.__count('throttle_wait_time', wait)
+            token = self._token
+            request_headers = dict(headers or {})
+            request_headers['Authorization'] = 'Bearer ' + token
+            response = None
+            error = None
+            self.__count('requests')
+            if self.hooks:
+                start = time.time()
+                timer = time.perf_counter()
+            slots = self._request_slots
+            if slots is not None:
+                slots.acquire()
+            try:
+                response = self._session.request(method, request_uri,
+                                                 headers=request_headers,
+                                                 timeout=self._timeout,
+                                                 **kwargs)
+            except requests.exceptions.RequestException as err:
+                error = err
+            finally:
+                if slots is not None:
+                    slots.release()
+            if self.hooks:
+                self.__notify(method, request_uri, response, error, start,
+                              time.perf_counter() - timer, attempt=attempt,
+                              stream=kwargs.get('stream', False),
+                              data=kwargs.get('data'))
+            if response is not None and response.status_code == 401 and \
+                    not token_refreshed:
+                logging.info('Access token rejected, fetching a new token')
+                response.close()
+                self._token_manager.refresh(rejected_token=token)
+                token_refreshed = True
+                continue
+            if attempt < self.retry.max_retries and \
+                    self.retry.should_retry(method, response, error):
+                delay = self.retry.delay(attempt, response)
+                logging.info('Retrying ' + method + ' ' + request_uri +
+                             ' in ' + str(round(delay, 2)) + ' seconds (' +
+                             (str(error) if error is not None else
+                              str(response.status_code)) + ')')
+                self.__count('retries')
+                # release the connection (a streamed body is not read)
+                if response is not None:
+                    response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if error is not None:
+                raise error
+            return response
+
+    def __request_get(self, request, stream=False):
         assert(type(request) == str)
         request_uri = self._base_url + self._api_request_path + request
+        return self.__request_get_uri(request_uri, stream=stream)
+
+    def __request_get_uri(self, request_uri, stream=False):
+        # stream: do not download the body yet (and do not cache it), read
+        # it incrementally from response.raw or response.iter_content()
+        headers = {}
+        ttl = None if stream else self.__cache_ttl_for(request_uri)
+        entry = None
+        if ttl:
+            entry = self.cache.get(request_uri)
+            if entry is not None:
+                if entry['expires'] > time.time():
+                    response = _cached_response(entry, request_uri)
+                    if self.hooks:
+                        self.__notify('GET', request_uri, response, None,
+                                      time.time(), 0., cache_hit=True)
+                    return response
+                # expired; revalidate if the server supports it
+                if 'ETag' in entry['headers']:
+                    headers['If-None-Match'] = entry['headers']['ETag']
+                if 'Last-Modified' in entry['headers']:
+                    headers['If-Modified-Since'] = \
+                        entry['headers']['Last-Modified']
+        response = None
         try:
-            response = requests.get(request_uri,
-                                    headers={'Authorization': 'Bearer ' +
-                                             self._token})
+            response = self.__send('GET', request_uri, headers=headers,
+                                   stream=stream)
             response.raise_for_status()
         except requests.exceptions.HTTPError as errh:
-            logging.warning("Http Error:", errh)
+            logging.warning("Http Error: %s", errh)
             # 500: timeout when too much data is requested with export fnc
             # 404: data not available for request
         except requests.exceptions.ConnectionError as errc:
-            logging.warning("Error Connecting:", errc)
+            logging.warning("Error Connecting: %s", errc)
         except requests.exceptions.Timeout as errt:
-            logging.warning("Timeout Error:", errt)
+            logging.warning("Timeout Error: %s", errt)
         except requests.exceptions.RequestException as err:
-            logging.warning("Oops: Something Else", err)
+            logging.warning("Oops: Something Else: %s", err)
+        if entry is not None and response is not None and \
+                response.status_code == 304:  # not modified
+            entry['expires'] = time.time() + ttl
+            self.cache.set(request_uri, entry)
+            return _cached_response(entry, request_uri)
         if response:
+            if ttl:
+                self.cache.set(request_uri, {
+                    'content': response.content,
+                    'headers': {key: response.headers[key] for key in
+                                ['Content-Type', 'ETag', 'Last-Modified']
+                                if key in response.headers},
+                    'expires': time.time() + ttl})
             return response
         else:
-            raise NameError('error with api request (' +
-                            request+'): ' + response.text)
+            raise NameError('error with api request (' + request_uri + '): '
+                            + (response.text if response is not None
+                               else 'no response'))
+
+    def __cache_ttl_for(self, request_uri):
+        if self.cache is None:
+            return None
+        parts = urllib.parse.urlsplit(request_uri)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        for pattern, ttl in self.cache_ttl.items():
+            if ttl and re.search(pattern, path):
+                return ttl
+        return None
+
+    def clear_cache(self):
+        if self.cache is not None:
+            self.cache.clear()
 
     def __request_post(self, request, dict_body):
         assert(type(request) == str)
         assert(type(dict_body) == dict)
         request_uri = self._base_url + self._api_request_path + request
+        response = None
         try:
-            response = requests.post(request_uri,
-                                     headers={'Authorization': 'Bearer ' +
-                                              self._token,
-                                              'content-type': 'application/json'},
-                                     data=json.dumps(dict_body))
+            response = self.__send('POST', request_uri,
+                                   headers={'content-type':
+                                            'application/json'},
+                                   data=json.dumps(dict_body))
             response.raise_for_status()
             if response.status_code == 201:
                 logging.info('Field value successfully created')
@@ -147,42 +983,104 @@ class CastorApi:
                 raise NameError('Unexpected error - '
                                 + response.content)
         except requests.exceptions.HTTPError as errh:
-            logging.warning("Http Error:", errh)
+            logging.warning("Http Error: %s", errh)
             # 500: timeout when too much data is requested with export fnc
             # 404: data not available for request
         except requests.exceptions.ConnectionError as errc:
-            logging.warning("Error Connecting:", errc)
+            logging.warning("Error Connecting: %s", errc)
         except requests.exceptions.Timeout as errt:
-            logging.warning("Timeout Error:", errt)
+            logging.warning("Timeout Error: %s", errt)
         except requests.exceptions.RequestException as err:
-            logging.warning("Oops: Something Else", err)
+            logging.warning("Oops: Something Else: %s", err)
         if response:
             return response
         else:
             raise NameError('error with api request (' + request +
                             ') and body (' + json.dumps(dict_body) + '): ' +
-                            response.text)
+                            (response.text if response is not None
+                             else 'no response'))
+
+    def __json(self, response):
+        # parse the body straight from the bytes, without decoding it to str
+        # first (unless the server sent another encoding than UTF-8)
+        encoding = (response.encoding or 'utf-8').lower().replace('_', '-')
+        if encoding in ['utf-8', 'utf8', 'ascii', 'us-ascii']:
+            return self.json_decoder(response.content)
+        return self.json_decoder(response.text)
+
+    def __request_json_get(self, request, page_size=None):
+        # page_size: overrides self.page_size for this request
+        page_size = page_size or self.page_size
+        if not self.coalesce:
+            return self.__request_json_get_pages(request, page_size)
+        # single flight: if the same request is already in flight (in another
+        # thread), wait for its result instead of sending it again
+        key = (request, page_size)
+        with self._in_flight_lock:
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                # [future, number of waiting threads]
+                in_flight = self._in_flight[key] = [Future(), 0]
+                leader = True
+            else:
+                in_flight[1] += 1
+                leader = False
+        future = in_flight[0]
+        if not leader:
+            self.__count('coalesced')
+            # every thread gets its own copy, callers may modify the result
+            return self.json_decoder(future.result())
+        try:
+            rd = self.__request_json_get_pages(request, page_size)
+        except BaseException as err:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+            future.set_exception(err)
+            raise
+        with self._in_flight_lock:
+            del self._in_flight[key]
+        if in_flight[1]:
+            future.set_result(json.dumps(rd))
+        return rd
 
-    def __request_json_get(self, request):
-        response = self.__request_get(request)
-        rd = response.json()
+    def __request_json_get_pages(self, request, page_size=None):
+        pages = self.__request_json_iter(request, page_size)
+        rd = next(pages)
         # pagination: sometimes multiple entries are found; combine these
-        if 'page' in rd and '_embedded' in rd:
-            rd2 = rd
-            while rd2['page'] < rd2['page_count']:
-                request_uri = rd2['_links']['next']['href']
-                response = requests.get(request_uri,
-                                        headers={'Authorization': 'Bearer ' +
-                                                 self._token})
-                rd2 = response.json()
-                for key in rd2['_embedded'].keys():
-                    rd['_embedded'][key] += \
-                        rd2['_embedded'][key]
+        for rd2 in pages:
+            for key in rd2['_embedded'].keys():
+                rd['_embedded'][key] += \
+                    rd2['_embedded'][key]
         return rd
 
+    def __request_json_iter(self, request, page_size=None):
+        # yields the pages of a (paginated) response one by one
+        page_size = page_size or self.page_size
+        if page_size:
+            request = _add_query_parameter(request, 'page_size', page_size)
+        rd = self.__json(self.__request_get(request))
+        yield rd
+        if 'page' in rd and '_embedded' in rd and \
+                rd['page'] < rd['page_count'] and 'next' in rd['_links']:
+            # the first page tells how many pages there are, so the next
+            # pages can be fetched ahead while earlier pages are consumed.
+            # At most 2 * page_workers pages are held in memory.
+            request_uris = _page_uris(rd['_links']['next']['href'],
+                                      rd['page'], rd['page_count'])
+            workers = max(1, self.page_workers)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = deque()
+                for request_uri in request_uris:
+                    futures.append(executor.submit(self.__request_get_uri,
+                                                   request_uri))
+                    if len(futures) >= 2 * workers or workers == 1:
+                        yield self.__json(futures.popleft().result())
+                while futures:
+                    yield self.__json(futures.popleft().result())
+
     def __request_json_post(self, request, body):
         response = self.__request_post(request, body)
-        rd = response.json()
+        rd = self.__json(response)
         # pagination: sometimes multiple entries are found; combine these
         if 'page' in rd and '_embedded' in rd:
             raise NameError('Did not expect pagination for result of POST.')
@@ -231,56 +1129,21 @@ class CastorApi:
                 return rd
 
     # %% data-point-collection
-    def request_datapointcollection(self, study_id=None, request_type='study',
-                                    record_id=None, report_instance_id=None,
-                                    survey_instance_id=None,
-                                    survey_package_instance_id=None,
-                                    field_id=None,
-                                    field_value=None,
-                                    instance_id=None,
-                                    change_reason_specific=None,
-                                    confirmed_changes_specific=False,
-                                    request_method='GET'):
-        # request_type: GET  -> get request
-        #               POST -> post request, requires field_id and field_value
-        study_id = self.__study_id_saveload(study_id)
-
-        if request_method == 'POST':
-            if field_id is not None and field_value is not None:
-                body = {
-                    'field_id': field_id,
-                    'field_value': field_value
-                }
-
-            else:
-                raise NameError('Use as least study_id, record_id, '
-                                + 'field_id and field_value as inputs.')
-
-        rd = None
+    def __datapointcollection_url(self, study_id, request_type, record_id,
+                                  report_instance_id, survey_instance_id,
+                                  survey_package_instance_id):
+        request_url = None
         if request_type == 'study':
             if record_id:
                 request_url = \
                     '/study/'+study_id +\
                     '/record/'+record_id +\
                     '/data-point-collection/study'
-
-                if request_method == 'POST':
-                    if change_reason_specific is not None:
-                        body['change_reason'] = change_reason_specific
-
-                    if confirmed_changes_specific is not None:
-                        body['confirmed_changes'] = confirmed_changes_specific
-
-                    body = {
-                        'common': {
-                            'change_reason': 'Update using API',
-                            'confirmed_changes': True
-                            },
-                        'data': [body]
-                    }
-
             else:
-                raise Exception('Record ID required for endpoint \'study\'')
+                # all study data points of the study
+                request_url = \
+                    '/study/'+study_id +\
+                    '/data-point-collection/study'
 
         elif request_type == 'report-instance':
             if record_id:
@@ -290,21 +1153,6 @@ class CastorApi:
                         '/record/'+record_id +\
                         '/data-point-collection/report-instance/' +\
                         report_instance_id
-
-                    if request_method == 'POST':
-                        if change_reason_specific is not None:
-                            body['change_reason'] = change_reason_specific
-
-                        if confirmed_changes_specific is not None:
-                            body['confirmed_changes'] = confirmed_changes_specific
-
-                        body = {
-                            'common': {
-                                'change_reason': 'Update using API',
-                                'confirmed_changes': True
-                                },
-                            'data': [body]
-                        }
                 else:
                     request_url = \
                         '/study/'+study_id +\
@@ -336,12 +1184,6 @@ class CastorApi:
                         '/data-point-collection/survey-instance/' +\
                         survey_instance_id
 
-                    if request_method == 'POST':
-                        if instance_id is not None:
-                            body['instance_id'] = instance_id
-
-                        body = {'data': [body]}
-
             else:
                 if survey_instance_id:
                     request_url = \
@@ -366,9 +1208,66 @@ class CastorApi:
                         '/data-point-collection' +\
                         '/survey-package-instance/' +\
                         survey_package_instance_id
+        return request_url
+
+    def request_datapointcollection(self, study_id=None, request_type='study',
+                                    record_id=None, report_instance_id=None,
+                                    survey_instance_id=None,
+                                    survey_package_instance_id=None,
+                                    field_id=None,
+                                    field_value=None,
+                                    instance_id=None,
+                                    change_reason_specific=None,
+                                    confirmed_changes_specific=False,
+                                    request_method='GET'):
+        # request_type: GET  -> get request
+        #               POST -> post request, requires field_id and field_value
+        study_id = self.__study_id_saveload(study_id)
+
+        if request_method == 'POST':
+            if field_id is not None and field_value is not None:
+                body = {
+                    'field_id': field_id,
+                    'field_value': field_value
+                }
+
+            else:
+                raise NameError('Use as least study_id, record_id, '
+                                + 'field_id and field_value as inputs.')
+
+        rd = None
+        request_url = self.__datapointcollection_url(
+            study_id, request_type, record_id, report_instance_id,
+            survey_instance_id, survey_package_instance_id)
+
+        if request_method == 'POST':
+            if request_type == 'study' or \
+                    (request_type == 'report-instance' and record_id and
+                     report_instance_id):
+                if change_reason_specific is not None:
+                    body['change_reason'] = change_reason_specific
+
+                if confirmed_changes_specific is not None:
+                    body['confirmed_changes'] = confirmed_changes_specific
+
+                body = {
+                    'common': {
+                        'change_reason': 'Update using API',
+                        'confirmed_changes': True
+                        },
+                    'data': [body]
+                }
+
+            elif request_type == 'survey-instance' and record_id and \
+                    not survey_instance_id:
+                if instance_id is not None:
+                    body['instance_id'] = instance_id
+
+                body = {'data': [body]}
 
         if request_method == 'GET':
-            rd = self.__request_json_get(request_url)
+            rd = self.__request_json_get(
+                request_url, self.__collection_page_size(record_id))
         elif request_method == 'POST':
             rd = self.__request_json_post(request_url, body)
 
@@ -377,6 +1276,137 @@ class CastorApi:
         else:
             return rd
 
+    def __collection_page_size(self, record_id):
+        # larger pages for the collections of all records of a study
+        if record_id:
+            return None
+        return max(self.page_size or 0, self.bulk_page_size)
+
+    def iter_datapointcollection(self, study_id=None, request_type='study',
+                                 record_id=None, report_instance_id=None,
+                                 survey_instance_id=None,
+                                 survey_package_instance_id=None):
+        """
+        Iterate over data points without keeping them all in memory.
+
+        Takes the same arguments as request_datapointcollection (GET only).
+        Data points are yielded page by page as they arrive. Without
+        record_id, the data points of all records are streamed from the
+        study-level collection (in pages of bulk_page_size).
+
+        Yields
+        ------
+        Dict
+            One data point (field_id, field_value, record_id, ...).
+        """
+        study_id = self.__study_id_saveload(study_id)
+        request_url = self.__datapointcollection_url(
+            study_id, request_type, record_id, report_instance_id,
+            survey_instance_id, survey_package_instance_id)
+        for rd in self.__request_json_iter(
+                request_url, self.__collection_page_size(record_id)):
+            if '_embedded' in rd and 'items' in rd['_embedded']:
+                for item in rd['_embedded']['items']:
+                    yield item
+            else:
+                yield rd
+
+    def post_datapoints(self, rows, study_id=None,
+                        change_reason='Update using API',
+                        confirmed_changes=True, max_workers=1,
+                        max_requests_per_second=None, progress=None):
+        """
+        Post many data points with as few requests as possible.
+
+        The rows are grouped per record (study data) and per report instance
+        (report data), and every group is posted in a single
+        data-point-collection request.
+
+        Parameters
+        ----------
+        rows : DataFrame or iterable
+            DataFrame with columns record_id, field_id, field_value and
+            optionally report_instance_id, or an iterable of
+            (record_id, field_id, field_value) or
+            (record_id, field_id, field_value, report_instance_id) tuples.
+            Use report_instance_id None for study data.
+        study_id : STR, optional
+            Study_ID from Castor EDC. The default is the saved study_id.
+        change_reason : STR, optional
+            Change reason stored with every data point.
+        confirmed_changes : BOOL, optional
+            Confirm changes of data points that already have a value.
+        max_workers : INT, optional
+            Number of requests that are posted concurrently.
+        max_requests_per_second : FLOAT, optional
+            Upper limit on the number of requests per second.
+        progress : BOOL, optional
+            Show a progress bar (requires progressbar2). The default shows
+            it when progressbar is already imported.
+
+        Returns
+        -------
+        List
+            One dict per request with record_id, report_instance_id,
+            field_ids and either the response of Castor (which lists the
+            'success' and 'failed' data points) or the 'error'.
+        """
+        study_id = self.__study_id_saveload(study_id)
+
+        # a DataFrame (checked without importing pandas)
+        if hasattr(rows, 'itertuples'):
+            columns = ['record_id', 'field_id', 'field_value']
+            if 'report_instance_id' in rows.columns:
+                columns.append('report_instance_id')
+            rows = rows[columns].itertuples(index=False, name=None)
+
+        # group per record and report instance, keeping the input order
+        groups = {}
+        for row in rows:
+            record_id, field_id, field_value = row[0:3]
+            report_instance_id = row[3] if len(row) > 3 else None
+            if report_instance_id is not None and \
+                    report_instance_id != report_instance_id:  # NaN
+                report_instance_id = None
+            groups.setdefault((record_id, report_instance_id), []).append(
+                {'field_id': field_id, 'field_value': field_value})
+
+        limiter = None
+        if max_requests_per_second:
+            limiter = RateLimiter(max_requests_per_second)
+
+        def post_group(group):
+            (record_id, report_instance_id), data = group
+            result = {'record_id': record_id,
+                      'report_instance_id': report_instance_id,
+                      'field_ids': [d['field_id'] for d in data]}
+            request_url = self.__datapointcollection_url(
+                study_id, 'report-instance' if report_instance_id
+                else 'study', record_id, report_instance_id, None, None)
+            if limiter:
+                limiter.acquire()
+            try:
+                result['response'] = self.__request_json_post(
+                    request_url, {'common': {
+                        'change_reason': change_reason,
+                        'confirmed_changes': confirmed_changes},
+                        'data': data})
+            except NameError as err:
+                logging.warning('Posting data for record ' + record_id +
+                                ' failed: ' + str(err))
+                result['error'] = str(err)
+            return result
+
+        if progress is None:
+            progress = 'progressbar' in sys.modules
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            results = executor.map(post_group, groups.items())
+            if progress:
+                results = progressbar.progressbar(
+                    results, max_value=len(groups),
+                    prefix='Posting records: ')
+            return list(results)
+
     # %% export
     def request_study_export_structure(self, study_id=None):
         study_id = self.__study_id_saveload(study_id)
@@ -384,12 +1414,82 @@ class CastorApi:
         data = process_table(response.text)
         return data
 
-    def request_study_export_data(self, study_id=None):
+    def request_study_export_data(self, study_id=None, typed=False):
+        # typed: use categorical columns for ids, names and types (see
+        # EXPORT_CATEGORICAL_COLUMNS) and datetime64 for the Date column,
+        # which takes a fraction of the memory of str columns
         study_id = self.__study_id_saveload(study_id)
         response = self.__request_get('/study/'+study_id+'/export/data')
         data = process_table(response.text)
+        if typed:
+            for column in EXPORT_CATEGORICAL_COLUMNS:
+                if column in data.columns:
+                    data[column] = data[column].astype('category')
+            if 'Date' in data.columns:
+                data['Date'] = pd.to_datetime(data['Date'], errors='coerce',
+                                              dayfirst=True)
         return data
 
+    def iter_study_export_data(self, study_id=None, chunksize=100000):
+        """
+        Iterate over the export data in chunks, with bounded memory.
+
+        The export is parsed while it is downloaded, so the full export is
+        never held in memory. Use this instead of request_study_export_data
+        for large studies.
+
+        Parameters
+        ----------
+        study_id : STR, optional
+            Study_ID from Castor EDC. The default is the saved study_id.
+        chunksize : INT, optional
+            Number of rows per chunk.
+
+        Yields
+        ------
+        DataFrame
+            chunksize rows of the export, with the same columns (and dtype
+            str) as request_study_export_data.
+        """
+        study_id = self.__study_id_saveload(study_id)
+        response = self.__request_get('/study/'+study_id+'/export/data',
+                                      stream=True)
+        try:
+            response.raw.decode_content = True  # e.g. gzip
+            for chunk in pd.read_table(response.raw, sep=';', quotechar='\"',
+                                       header=0, dtype='str',
+                                       encoding=response.encoding or 'utf-8',
+                                       chunksize=chunksize):
+                yield chunk
+        finally:
+            response.close()
+
+    def save_study_export_data(self, filename, study_id=None,
+                               chunk_bytes=1024 ** 2):
+        """
+        Download the export data straight to a (csv) file.
+
+        The export is written to disk as it arrives, without parsing it. Read
+        the file with pd.read_table(filename, sep=';', dtype='str').
+
+        Returns
+        -------
+        Int
+            The number of bytes written.
+        """
+        study_id = self.__study_id_saveload(study_id)
+        response = self.__request_get('/study/'+study_id+'/export/data',
+                                      stream=True)
+        size = 0
+        try:
+            with open(filename, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=chunk_bytes):
+                    file.write(chunk)
+                    size += len(chunk)
+        finally:
+            response.close()
+        return size
+
     def request_study_export_optiongroups(self, study_id=None):
         study_id = self.__study_id_saveload(study_id)
         response = self.__request_get('/study/'+study_id+'/export/optiongroups')
@@ -601,6 +1701,26 @@ class CastorApi:
         else:
             return rd
 
+    def iter_study_records(self, study_id=None, archived=0,
+                           institute_id=None):
+        """
+        Iterate over the records of a study, page by page.
+
+        Yields
+        ------
+        Dict
+            One record, as in the list returned by request_study_records.
+        """
+        study_id = self.__study_id_saveload(study_id)
+        additional_parameters = '?archived='+str(archived)
+        if institute_id:
+            additional_parameters += '&institute='+str(institute_id)
+        for rd in self.__request_json_iter('/study/'+study_id+'/record' +
+                                           additional_parameters):
+            if '_embedded' in rd and 'records' in rd['_embedded']:
+                for record in rd['_embedded']['records']:
+                    yield record
+
     # %% record-progress
     def request_recordprogress(self, study_id=None):
         study_id = self.__study_id_saveload(study_id)
@@ -924,16 +2044,458 @@ class CastorApi:
             return None
 
     def records_reports_all(self, study_id=None, report_names=[],
-                            add_including_center=False, include_columns_without_data=False):
+                            add_including_center=False,
+                            include_columns_without_data=False,
+                            max_workers=1, max_requests_per_second=None,
+                            typed=False, checkpoint_file=None, bulk=True):
+        """
+        Fetch all study and report data of a study as pandas DataFrames.
+
+        Parameters
+        ----------
+        study_id : STR, optional
+            Study_ID from Castor EDC. The default is the saved study_id.
+        add_including_center : BOOL, optional
+            Add a 'hospital' column with the institute of each record.
+        include_columns_without_data : BOOL, optional
+            Add (empty) columns for fields without any data entries.
+        max_workers : INT, optional
+            Number of records that are fetched concurrently. The default (1)
+            fetches the records one by one.
+        max_requests_per_second : FLOAT, optional
+            Upper limit on the number of data point requests per second,
+            shared by all workers. The default (None) does not limit.
+        typed : BOOL, optional
+            Cast the data columns to the type of their field (numbers,
+            datetime64, Categorical), see cast_field_types. The default
+            (False) returns all data as str.
+        checkpoint_file : STR, optional
+            Path of a (sqlite) file in which the data of every record is
+            stored as soon as it is fetched. If the export fails, call it
+            again with the same checkpoint_file to skip the records that
+            were already fetched. The file is removed when the export
+            completes. Store it in a private folder; it contains study data.
+        bulk : BOOL, optional
+            Fetch the data points of all records with the study-level
+            data point collections, i.e. a few paginated requests (fetched
+            page_workers at a time) instead of two requests per record. The
+            default is True. max_workers, max_requests_per_second and
+            checkpoint_file apply to the per-record requests (bulk=False);
+            with checkpoint_file, the records are fetched one by one.
+
+        Returns
+        -------
+        df_study, df_structure_study, df_report, df_structure_report,
+        df_optiongroups_structure
+            The data is ordered by record, regardless of max_workers.
+        """
         study_id = self.__study_id_saveload(study_id)
 
         logging.info('Fetching all data from study id (' + study_id +
                      '). This takes some time... be patient.')
 
+        records = self.__export_records(study_id)
+        # one str per distinct id for all data points (see _extend_columns)
+        interned = {}
+        bulk_data = None
+        checkpoint = None
+        if bulk and checkpoint_file is None:
+            bulk_data = self.__study_level_records_data(study_id, records,
+                                                        interned)
+        # the data points are stored per column as they arrive
+        study_data = {column: [] for column in STUDY_DATA_COLUMNS}
+        report_data = {column: [] for column in REPORT_DATA_COLUMNS}
+        if bulk_data is not None:
+            study_data, report_data = bulk_data
+        elif checkpoint_file is None:
+            for record_study_data, record_report_data in \
+                    self.__fetch_records_data(study_id, records, max_workers,
+                                              max_requests_per_second):
+                _extend_columns(study_data, record_study_data, interned)
+                _extend_columns(report_data, record_report_data, interned)
+        else:
+            checkpoint = RecordCheckpoint(checkpoint_file, study_id)
+            try:
+                done = checkpoint.record_ids()
+                todo = [r for r in records if r['record_id'] not in done]
+                if len(todo) < len(records):
+                    logging.info('Resuming from checkpoint ' +
+                                 checkpoint_file + ': ' +
+                                 str(len(records) - len(todo)) + ' of ' +
+                                 str(len(records)) +
+                                 ' records were already fetched.')
+                for _ in self.__fetch_records_data(
+                        study_id, todo, max_workers, max_requests_per_second,
+                        checkpoint=checkpoint):
+                    pass
+                for record in records:
+                    record_study_data, record_report_data = \
+                        checkpoint.load(record['record_id'])
+                    _extend_columns(study_data, record_study_data, interned)
+                    _extend_columns(report_data, record_report_data,
+                                    interned)
+            except BaseException:
+                checkpoint.close()
+                raise
+
+        try:
+            frames = self.__records_reports_frames(
+                study_id, records, study_data, report_data,
+                add_including_center=add_including_center,
+                include_columns_without_data=include_columns_without_data,
+                typed=typed)
+        except BaseException:
+            if checkpoint is not None:
+                checkpoint.close()
+            raise
+        # the frames need more requests (e.g. the export structure), so the
+        # checkpoint is only removed when they are built
+        if checkpoint is not None:
+            checkpoint.remove()
+        return frames
+
+    def save_records_reports(self, folder, study_id=None, report_names=[],
+                             file_format='parquet', partition=True,
+                             **kwargs):
+        """
+        Fetch all study and report data and write it to columnar datasets.
+
+        The data is typed (see cast_field_types) and the study data is
+        partitioned by institute, see write_records_reports for the layout.
+
+        Parameters
+        ----------
+        folder : STR
+            Output folder. The datasets in it must not exist yet.
+        file_format : STR, optional
+            'parquet' (default) or 'feather' (Arrow IPC).
+        partition : BOOL, optional
+            Partition the data by institute and report. The default is True.
+        Other parameters: see records_reports_all.
+
+        Returns
+        -------
+        folder
+
+        NOTE:
+        # Requires the pyarrow package (pip install pyarrow).
+        """
+        kwargs.setdefault('typed', True)
+        kwargs.setdefault('add_including_center', partition)
+        frames = self.records_reports_all(study_id=study_id,
+                                          report_names=report_names,
+                                          **kwargs)
+        return write_records_reports(frames, folder, file_format=file_format,
+                                     partition=partition)
+
+    def harvest_studies(self, folder, studies=None, max_studies=4,
+                        max_concurrent_requests=None, file_format='pickle',
+                        **kwargs):
+        """
+        Export the data of many studies concurrently.
+
+        The studies are exported with records_reports_all, max_studies at a
+        time, in threads that share this class instance: one connection
+        pool, one access token, the cache and the rate limit. A study that
+        fails does not stop the others; see the summary.
+
+        Parameters
+        ----------
+        folder : STR
+            Output folder. Each study is written to <study_id>.pkl or
+            <study_id>/ and the summary of the run to summary.json.
+        studies : LIST, optional
+            Study ids or study dicts (e.g. from request_study()). The
+            default is all studies of request_study().
+        max_studies : INT, optional
+            Number of studies that are exported at the same time.
+        max_concurrent_requests : INT, optional
+            Maximum number of requests in flight during the run, for all
+            studies together (including their page_workers). The default is
+            the limit of the instance, see CastorApi(max_concurrent_requests)
+        file_format : STR, optional
+            'pickle' (default): the five frames of records_reports_all in
+            one file, read it with pd.read_pickle. 'parquet' or 'feather':
+            see save_records_reports (requires pyarrow).
+        Other parameters: see records_reports_all.
+
+        Returns
+        -------
+        Dict
+            The summary of the run: start and end (local time), seconds,
+            the number of studies that succeeded and failed, the counters
+            (requests, retries, ...) of the run and per study its status
+            ('ok' or 'error'), error, seconds, number of records and report
+            instances and output path.
+        """
+        if file_format not in ['pickle', 'parquet', 'feather']:
+            raise NameError('file_format should be \'pickle\', '
+                            + '\'parquet\' or \'feather\'')
+        if studies is None:
+            studies = self.request_study()
+        studies = [s if isinstance(s, dict) else {'study_id': s}
+                   for s in studies]
+        os.makedirs(folder, exist_ok=True)
+
+        # the run uses a view of this instance: it shares the session, the
+        # access token, the cache, the rate limit and the counters, but has
+        # its own request budget and saved study id, so the instance (and
+        # other threads that use it) are not affected by the run
+        api = copy.copy(self)
+        if max_concurrent_requests:
+            api._request_slots = threading.BoundedSemaphore(
+                max_concurrent_requests)
+
+        def harvest(study):
+            study_id = study['study_id']
+            result = {'study_id': study_id, 'name': study.get('name'),
+                      'status': 'ok', 'error': None}
+            timer = time.perf_counter()
+            try:
+                if file_format == 'pickle':
+                    frames = api.records_reports_all(study_id, **kwargs)
+                    path = os.path.join(folder, study_id + '.pkl')
+                    pd.to_pickle(frames, path)
+                else:
+                    # the defaults of save_records_reports
+                    options = dict({'typed': True,
+                                    'add_including_center': True}, **kwargs)
+                    frames = api.records_reports_all(study_id, **options)
+                    path = write_records_reports(
+                        frames, os.path.join(folder, study_id),
+                        file_format=file_format)
+                result['records'] = len(frames[0])
+                result['report_instances'] = len(frames[2])
+                result['path'] = path
+            except Exception as err:
+                logging.warning('Exporting study ' + study_id +
+                                ' failed: %s', err)
+                result['status'] = 'error'
+                result['error'] = str(err)
+            result['seconds'] = time.perf_counter() - timer
+            return result
+
+        counters = dict(self.counters)
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, max_studies)) as executor:
+            results = list(executor.map(harvest, studies))
+        end = time.time()
+
+        summary = {
+            'start': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                   time.localtime(start)),
+            'end': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(end)),
+            'seconds': end - start,
+            'succeeded': sum(r['status'] == 'ok' for r in results),
+            'failed': sum(r['status'] == 'error' for r in results),
+            'counters': {key: self.counters[key] - counters[key]
+                         for key in counters},
+            'studies': results}
+        with open(os.path.join(folder, 'summary.json.tmp'), 'w') as file:
+            json.dump(summary, file, indent=2)
+        os.replace(os.path.join(folder, 'summary.json.tmp'),
+                   os.path.join(folder, 'summary.json'))
+        logging.info('Exported ' + str(summary['succeeded']) + ' of ' +
+                     str(len(results)) + ' studies in ' +
+                     str(round(summary['seconds'], 1)) + ' seconds.')
+        return summary
+
+    def records_reports_sync(self, snapshot_file, study_id=None,
+                             add_including_center=False,
+                             include_columns_without_data=False,
+                             max_workers=1, max_requests_per_second=None,
+                             typed=False):
+        """
+        Incremental version of records_reports_all.
+
+        The data points of all records are stored in snapshot_file, together
+        with a watermark per record (its updated_on date and progress). On
+        the next call only new records and records whose watermark changed
+        are fetched again; records that were removed are dropped.
+
+        Parameters
+        ----------
+        snapshot_file : STR
+            Path of the (json) snapshot file. It is created on the first
+            call. Store it in a private folder; it contains study data.
+        Other parameters: see records_reports_all.
+
+        Returns
+        -------
+        Same as records_reports_all.
+        """
+        study_id = self.__study_id_saveload(study_id)
+
+        snapshot = {'study_id': study_id, 'watermarks': {},
+                    'study_data': {}, 'report_data': {}}
+        if os.path.isfile(snapshot_file):
+            with open(snapshot_file, 'r') as file:
+                snapshot = json.load(file)
+            if snapshot['study_id'] != study_id:
+                raise NameError('snapshot ' + snapshot_file + ' belongs to '
+                                + 'study ' + snapshot['study_id'] + ', not to '
+                                + 'study ' + study_id)
+
+        records = self.__export_records(study_id)
+        progress = {p['record_id']: p for p in
+                    self.request_recordprogress(study_id)
+                    if isinstance(p, dict) and 'record_id' in p}
+        watermarks = {r['record_id']: json.dumps(
+            [r.get('updated_on'), progress.get(r['record_id'])],
+            sort_keys=True) for r in records}
+        changed = [r for r in records if
+                   snapshot['watermarks'].get(r['record_id']) !=
+                   watermarks[r['record_id']]]
+        logging.info(str(len(changed)) + ' of ' + str(len(records)) +
+                     ' records changed since the last sync of study id (' +
+                     study_id + ').')
+
+        for record, (record_study_data, record_report_data) in zip(
+                changed, self.__fetch_records_data(
+                    study_id, changed, max_workers,
+                    max_requests_per_second)):
+            snapshot['study_data'][record['record_id']] = \
+                _drop_links(record_study_data)
+            snapshot['report_data'][record['record_id']] = \
+                _drop_links(record_report_data)
+            snapshot['watermarks'][record['record_id']] = \
+                watermarks[record['record_id']]
+
+        # records that no longer exist are removed from the snapshot
+        snapshot = {'study_id': study_id,
+                    'watermarks': {r['record_id']: snapshot['watermarks'][
+                        r['record_id']] for r in records},
+                    'study_data': {r['record_id']: snapshot['study_data'][
+                        r['record_id']] for r in records},
+                    'report_data': {r['record_id']: snapshot['report_data'][
+                        r['record_id']] for r in records}}
+        # write to a temporary file first, an interrupted sync should not
+        # corrupt the snapshot
+        with open(snapshot_file + '.tmp', 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(snapshot_file + '.tmp', snapshot_file)
+
+        study_data = {column: [] for column in STUDY_DATA_COLUMNS}
+        report_data = {column: [] for column in REPORT_DATA_COLUMNS}
+        interned = {}
+        for record in records:
+            _extend_columns(study_data,
+                            snapshot['study_data'][record['record_id']],
+                            interned)
+            _extend_columns(report_data,
+                            snapshot['report_data'][record['record_id']],
+                            interned)
+        return self.__records_reports_frames(
+            study_id, records, study_data, report_data,
+            add_including_center=add_including_center,
+            include_columns_without_data=include_columns_without_data,
+            typed=typed)
+
+    def __export_records(self, study_id):
+        # GET ALL STUDY RECORDS
+        records = self.request_study_records(study_id)
+
+        if self.debug_mode:  # set to True when debugging.
+            records = records[0:25]  # test data
+            logging.warning('DEBUG MODE ACTIVE. ONLY PROCESSING ' +
+                            str(len(records))+' RECORDS')
+        return records
+
+    def __study_level_records_data(self, study_id, records, interned=None):
+        # (study data, report data) of the records from the study-level
+        # collections, or None if these are not available (the data is then
+        # fetched per record)
+        try:
+            return (self.__study_level_data(study_id, 'study', records,
+                                            STUDY_DATA_COLUMNS, interned),
+                    self.__study_level_data(study_id, 'report-instance',
+                                            records, REPORT_DATA_COLUMNS,
+                                            interned))
+        except NameError as err:
+            logging.warning('Study-level data points not available, fetching '
+                            + 'them per record: %s', err)
+            return None
+
+    def __study_level_data(self, study_id, request_type, records, columns,
+                           interned=None):
+        # the data points of the records from a study-level data point
+        # collection, as a dict with a list per column. The data points are
+        # grouped per record in the order of records, like the per-record
+        # requests; data points of other (e.g. archived) records are skipped.
+        # Each page is added to the columns and released as it arrives.
+        positions = {r['record_id']: i for i, r in enumerate(records)}
+        data = {column: [] for column in columns}
+        order = array.array('l')  # position of the record of each point
+        request_url = self.__datapointcollection_url(
+            study_id, request_type, None, None, None, None)
+        for rd in self.__request_json_iter(
+                request_url, self.__collection_page_size(None)):
+            if '_embedded' not in rd or 'items' not in rd['_embedded']:
+                continue
+            items = [item for item in rd['_embedded']['items']
+                     if item.get('record_id') in positions]
+            _extend_columns(data, items, interned)
+            order.extend([positions[item['record_id']] for item in items])
+        if any(order[i] > order[i + 1] for i in range(len(order) - 1)):
+            # stable sort: the points of a record stay in the same order
+            index = sorted(range(len(order)), key=order.__getitem__)
+            data = {column: [values[i] for i in index]
+                    for column, values in data.items()}
+        return data
+
+    def __fetch_records_data(self, study_id, records, max_workers=1,
+                             max_requests_per_second=None, checkpoint=None):
+        # GET ALL STUDY AND REPORT VALUES FOR STUDY RECORDS
+        # yields (study data, report data) for each record. With a
+        # checkpoint, every record is also saved as soon as it is fetched
+        # (without the _links), also when an earlier record failed.
+        limiter = None
+        if max_requests_per_second:
+            limiter = RateLimiter(max_requests_per_second)
+
+        def fetch_record(record):
+            if limiter:
+                limiter.acquire()
+            record_study_data = self.request_datapointcollection(
+                study_id=study_id, record_id=record['record_id'])
+            if limiter:
+                limiter.acquire()
+            record_report_data = self.request_datapointcollection(
+                study_id=study_id, request_type='report-instance',
+                record_id=record['record_id'])
+            if checkpoint is not None:
+                checkpoint.save(record['record_id'],
+                                _drop_links(record_study_data),
+                                _drop_links(record_report_data))
+            return record_study_data, record_report_data
+
+        # results are yielded in order of the records (to keep the output
+        # stable) as soon as they are available, so they can be processed
+        # and released while the next records are fetched
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = deque(executor.submit(fetch_record, record)
+                            for record in records)
+            try:
+                for _ in progressbar.progressbar(
+                        range(len(futures)), prefix='Retrieving records: '):
+                    yield futures.popleft().result()
+            except BaseException:
+                # do not fetch the remaining records after a failure
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def __records_reports_frames(self, study_id, records, study_data,
+                                 report_data,
+                                 add_including_center=False,
+                                 include_columns_without_data=False,
+                                 typed=False):
+        # study_data and report_data: dicts with a list per column (see
+        # STUDY_DATA_COLUMNS and REPORT_DATA_COLUMNS)
         # get study and report structure
         # sort on form collection order and field order
         # (this matches how data is filled)
-        structure_filtered = self.request_study_export_structure() \
+        structure_filtered = self.request_study_export_structure(study_id) \
             .sort_values(['Form Order', 'Form Collection Name',
                           'Form Collection Order', 'Field Order'])
 
@@ -946,57 +2508,44 @@ class CastorApi:
 
         # get option groups
         df_optiongroups_structure = pd.DataFrame(
-            self.request_study_export_optiongroups())
-
-        # GET ALL STUDY RECORDS
-        records = self.request_study_records(study_id)
-
-        if self.debug_mode:  # set to True when debugging.
-            records = records[0:25]  # test data
-            logging.warning('DEBUG MODE ACTIVE. ONLY PROCESSING ' +
-                            str(len(records))+' RECORDS')
+            self.request_study_export_optiongroups(study_id))
 
-        # GET ALL STUDY AND REPORT VALUES FOR STUDY RECORDS - no data: None
-        study_data = []
-        report_data = []
         hospitals = {r['id']: r['_embedded']['institute']['name']
                      for r in records}
-        for record in progressbar.progressbar(records,
-                                              prefix='Retrieving records: '):
-            study_data += self.request_datapointcollection(
-                record_id=record['record_id'])
-            report_data += self.request_datapointcollection(
-                request_type='report-instance',
-                record_id=record['record_id'])
-        df_study = pd.pivot(pd.DataFrame(study_data),
-                            values='field_value', index='record_id',
-                            columns='field_id')
+        df_study = _long_to_wide([study_data['record_id']],
+                                 study_data['field_id'],
+                                 study_data['field_value'],
+                                 names=['record_id', 'field_id'])
         if add_including_center:
             df_study['hospital'] = df_study.index
             df_study['hospital'] = df_study['hospital'].replace(hospitals)
 
-        # field_id -> field_variable_name
-        fields = self.request_field(include='optiongroup')
-        field_dict = {f['field_id']: f['field_variable_name'] for f in fields}
+        # field_id -> field_variable_name, the fields are requested again to
+        # include changes since the index was built
+        field_index = self.field_index(study_id, refresh=True)
+        field_dict = field_index.variable_names()
         df_study.rename(columns=field_dict, inplace=True)
 
         # Some columns do not have any data entries; add them and fill them with NaN
         if include_columns_without_data:
-            for nc in [f['field_variable_name'] for f in fields]:
+            for nc in [f['field_variable_name'] for f in field_index.fields]:
                 if nc not in df_study.columns:
                      df_study[nc] = float('nan')
                                 
         df_study.reset_index(level=0, inplace=True)
 
-        df_report = pd.DataFrame(report_data)
-        if not df_report.empty:
-            # aggfunc is ', '.join, but no duplicate entries are expected
-            # when indexing on report_instance_id.
-            df_report = pd.pivot_table(df_report,
-                                       index=['record_id',
-                                              'report_instance_id'],
-                                       values='field_value',
-                                       columns='field_id', aggfunc=', '.join)
+        df_report = pd.DataFrame()
+        if report_data['field_id']:
+            # no duplicate entries are expected when indexing on
+            # report_instance_id, if there are any they are joined by ', '
+            df_report = _long_to_wide([report_data['record_id'],
+                                       report_data['report_instance_id']],
+                                      report_data['field_id'],
+                                      report_data['field_value'],
+                                      names=['record_id',
+                                             'report_instance_id',
+                                             'field_id'],
+                                      join_duplicates=True)
             df_report.rename(columns=field_dict, inplace=True)
             df_report.reset_index(level=0, inplace=True)
         else:
@@ -1013,19 +2562,47 @@ class CastorApi:
             df_report.rename(columns=rename_cols, inplace=True)
         df_study.rename(columns=rename_cols, inplace=True)
 
+        if typed:
+            df_study = cast_field_types(df_study, df_structure_study,
+                                        df_optiongroups_structure)
+            if not df_report.empty:
+                df_report = cast_field_types(df_report, df_structure_report,
+                                             df_optiongroups_structure)
+
         # return data
         return df_study, df_structure_study, df_report, \
             df_structure_report, df_optiongroups_structure
 
+    def field_index(self, study_id=None, refresh=False):
+        """
+        Lookup tables for the fields of a study (see FieldIndex).
+
+        The fields are requested once per study and kept in the class
+        instance. Use refresh=True (or invalidate_field_index) after fields
+        were changed in Castor.
+        """
+        study_id = self.__study_id_saveload(study_id)
+        with self._field_indexes_lock:
+            index = None if refresh else self._field_indexes.get(study_id)
+        if index is None:
+            # requested outside the lock, so other studies are not blocked
+            index = FieldIndex(self.request_field(study_id=study_id,
+                                                  include='optiongroup'))
+            with self._field_indexes_lock:
+                self._field_indexes[study_id] = index
+        return index
+
+    def invalidate_field_index(self, study_id=None):
+        # study_id None: invalidate the indexes of all studies
+        with self._field_indexes_lock:
+            if study_id is None:
+                self._field_indexes.clear()
+            else:
+                self._field_indexes.pop(study_id, None)
+
     def field_optiongroup_by_variable_name(self, field_name, study_id=None):
         study_id = self.__study_id_saveload(study_id)
-        fields = [f for f in self.request_field(
-            include='optiongroup') if f['field_variable_name'] == field_name]
-        if len(fields) == 1 and 'option_group' in fields[0]:
-            field_optiongroup_id = fields[0]['option_group']['id']
-            return field_optiongroup_id
-        else:
-            return None
+        return self.field_index(study_id).optiongroup_id(field_name)
 
     def __studydataentry_or_none(self, study_id=None, record_id=None,
                                  field_id=None):
@@ -1042,15 +2619,38 @@ class CastorApi:
         return value
 
     def field_values_by_variable_name(self, field_name, study_id=None,
-                                      records=None):
+                                      records=None, batched=None):
+        """
+        Values of one field for a list of records.
+
+        Parameters
+        ----------
+        field_name : STR
+            Field variable name.
+        study_id : STR, optional
+            Study_ID from Castor EDC. The default is the saved study_id.
+        records : LIST, DICT or STR, optional
+            Records (as returned by request_study_records) or a record_id.
+            The default is all records of the study.
+        batched : BOOL or STR, optional
+            True: get the values from the study-level data point collection
+            (the data points of all records, in pages of bulk_page_size).
+            False: one request per record. 'export': get the values from
+            one export of the study data (see
+            field_values_by_variable_names). The default (None) uses the
+            collection when it has fewer pages than there are records; its
+            first page is requested to find out.
+
+        Returns
+        -------
+        List
+            The value for each record, None if there is no value.
+        """
         study_id = self.__study_id_saveload(study_id)
 
         # find field_id from field_name
-        fields = [f for f in self.request_field(
-        ) if f['field_variable_name'] == field_name]
-        if fields:
-            field_id = fields[0]['field_id']
-        else:
+        field_id = self.field_index(study_id).field_id(field_name)
+        if field_id is None:
             return None
 
         # collect or use input records
@@ -1068,6 +2668,17 @@ class CastorApi:
         # get value or set None if no data was found
         if records:
             assert(type(records) == list)
+            if batched == 'export':
+                values = self.field_values_by_variable_names(
+                    [field_name], study_id=study_id, records=records)
+                return [None if pd.isna(value) or value == '' else value
+                        for value in values[field_name]]
+            if batched or batched is None:
+                field_values = self.__study_level_field_values(
+                    study_id, field_id, records,
+                    max_pages=len(records) if batched is None else None)
+                if field_values is not None:
+                    return field_values
             field_values = [self.__studydataentry_or_none(
                 record_id=record['record_id'], field_id=field_id)
                 for record in records]
@@ -1075,6 +2686,451 @@ class CastorApi:
         else:
             return None
 
+    def __study_level_field_values(self, study_id, field_id, records,
+                                   max_pages=None):
+        # the values of a field for the records from the study-level data
+        # point collection, None if there is no value. Returns None if the
+        # collection has more than max_pages pages; only its first page is
+        # requested then.
+        request_url = self.__datapointcollection_url(
+            study_id, 'study', None, None, None, None)
+        pages = self.__request_json_iter(
+            request_url, self.__collection_page_size(None))
+        values = {}
+        try:
+            for rd in pages:
+                if max_pages is not None and \
+                        rd.get('page_count', 1) > max_pages:
+                    return None
+                if '_embedded' not in rd or 'items' not in rd['_embedded']:
+                    continue
+                for item in rd['_embedded']['items']:
+                    if item.get('field_id') == field_id:
+                        values[item['record_id']] = item.get('field_value')
+        finally:
+            pages.close()
+        return [values.get(record['record_id']) or None
+                for record in records]
+
+    def field_values_by_variable_names(self, field_names, study_id=None,
+                                       records=None):
+        """
+        Values of several fields for all (or a list of) records.
+
+        The values are taken from one (streamed) export of the study data,
+        so the number of requests does not depend on the number of records.
+
+        Parameters
+        ----------
+        field_names : LIST
+            Field variable names.
+        study_id : STR, optional
+            Study_ID from Castor EDC. The default is the saved study_id.
+        records : LIST, optional
+            Records (as returned by request_study_records). The default is
+            all records of the study.
+
+        Returns
+        -------
+        DataFrame
+            A row per record (index: record_id) and a column per field
+            variable name. NaN if there is no value.
+        """
+        study_id = self.__study_id_saveload(study_id)
+        field_index = self.field_index(study_id)
+        field_ids = {field_index.field_id(name): name for name in field_names
+                     if field_index.field_id(name) is not None}
+        if records is None:
+            records = self.request_study_records(study_id)
+
+        parts = [chunk.loc[(chunk['Form Type'] == 'Study') &
+                           chunk['Field ID'].isin(list(field_ids)),
+                           ['Record ID', 'Field ID', 'Value']]
+                 for chunk in self.iter_study_export_data(study_id)]
+        data = pd.concat(parts) if parts else \
+            pd.DataFrame(columns=['Record ID', 'Field ID', 'Value'])
+        values = _long_to_wide([data['Record ID']], data['Field ID'],
+                               data['Value'], names=['record_id', 'field_id'])
+        values = values.rename(columns=field_ids)
+        values = values.reindex(index=[r['record_id'] for r in records],
+                                columns=list(field_names))
+        values.columns.name = None
+        return values
+
+
+class _Deferred(Exception):
+    # a request of a _RequestPlan that has no response yet
+    def __init__(self, request):
+        Exception.__init__(self, request)
+        self.request = request
+
+
+class _RequestPlan(CastorApi):
+    # runs a CastorApi method without a connection, so AsyncCastorApi can
+    # use its URLs, parameters and the unwrapping of the responses. The
+    # requests of the method are answered in order from responses, a list
+    # of (request, response). The first request without a response raises
+    # _Deferred; the caller sends it and runs the method again.
+    def __init__(self, page_size, bulk_page_size, study_id, responses):
+        # no CastorApi.__init__: there is no session and no access token
+        self.page_size = page_size
+        self.bulk_page_size = bulk_page_size
+        self._CastorApi__study_id_saved = study_id
+        self._responses = responses
+        self._answered = 0
+
+    def __answer(self, request):
+        if self._answered < len(self._responses):
+            answered_request, response = self._responses[self._answered]
+            if answered_request != request:
+                raise NameError('request ' + str(request) + ' differs from '
+                                + 'the earlier request '
+                                + str(answered_request))
+            self._answered += 1
+            return response
+        raise _Deferred(request)
+
+    def _CastorApi__request_get(self, request, stream=False):
+        return self.__answer(('GET', request, None))
+
+    def _CastorApi__request_json_get(self, request, page_size=None):
+        return self.__answer(('JSON', request, page_size or self.page_size))
+
+    def _CastorApi__request_json_iter(self, request, page_size=None):
+        # the response is a list of pages
+        return iter(self.__answer(('PAGES', request,
+                                   page_size or self.page_size)))
+
+    def _CastorApi__request_json_post(self, request, body):
+        return self.__answer(('POST', request, body))
+
+
+class AsyncCastorApi:
+    """AsyncCastorApi class
+    USAGE:
+    from castorapi.castorapi import AsyncCastorApi
+    async with AsyncCastorApi('/path/to/folder/with/secret_client',
+                              max_concurrency=10) as c:
+        records = await c.request_study_records(study_id)
+        data = await asyncio.gather(*[
+            c.request_datapointcollection(record_id=r['record_id'])
+            for r in records])
+        async for record in c.iter_study_records(study_id):
+            ...
+
+    Requires the httpx package (pip install castorapi[async]).
+
+    NOTE:
+    # The requests are sent by an asynchronous HTTP client (httpx) on the
+      event loop; no threads are used.
+    # The request_* methods and select_study_by_name are coroutines with
+      the arguments and results of the CastorApi methods, the
+      iter_study_records and iter_datapointcollection methods are async
+      iterators. They run the CastorApi methods for the URLs and the
+      unwrapping of the responses (see _RequestPlan).
+    # At most max_concurrency requests are in flight at the same time
+      (including the pages of paginated responses), so it is safe to
+      gather over thousands of records.
+    # Transient errors are retried according to the retry policy and the
+      access token is refreshed before it expires (and when it is
+      rejected). The cache, the request hooks and the exports
+      (records_reports_all, ...) are only available in CastorApi.
+    # The instance can be used in more than one event loop (asyncio.run).
+      Use `async with` or close() to close the connections of a loop.
+    """
+
+    _base_url = CastorApi._base_url
+    _token_path = CastorApi._token_path
+    _api_request_path = CastorApi._api_request_path
+
+    # the access token is refreshed refresh_margin seconds before it expires
+    refresh_margin = 300
+
+    # see CastorApi
+    __study_id_saved = None
+
+    def __init__(self, folder_with_client_and_secret=None,
+                 client_id=None,
+                 client_secret=None,
+                 max_concurrency=10,
+                 timeout=None,
+                 page_size=None,
+                 page_workers=4,
+                 retry=None,
+                 base_url=None,
+                 json_decoder='auto'):
+        try:
+            self._limits = httpx.Limits(max_connections=max_concurrency)
+        except ImportError:
+            raise ImportError('AsyncCastorApi requires the httpx package '
+                              + '(pip install castorapi[async])')
+        if base_url is not None:
+            self._base_url = base_url
+        if folder_with_client_and_secret is not None and \
+                os.path.isdir(folder_with_client_and_secret):
+            client_id, client_secret = _read_client_and_secret(
+                folder_with_client_and_secret)
+        if client_id is None or client_secret is None:
+            raise NameError('AsyncCastorApi expects a folder with a '
+                            + '\'secret\' and a \'client\' file, or the '
+                            + 'client_id and client_secret')
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self.max_concurrency = max_concurrency
+        self._timeout = timeout
+        self.page_size = page_size
+        self.page_workers = page_workers
+        self.bulk_page_size = CastorApi.bulk_page_size
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.json_decoder = get_json_decoder(json_decoder)
+        self.counters = {'requests': 0, 'retries': 0}
+        self._token = None
+        self._refresh_at = 0
+        # the HTTP client, request slots and token lock of the event loop
+        # that used the instance last (see __loop_state)
+        self._loop = None
+        self._client = None
+        self._slots = None
+        self._token_lock = None
+
+    def __loop_state(self):
+        # asyncio objects belong to one event loop; new ones are created
+        # when the instance is used in another loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(limits=self._limits,
+                                             timeout=self._timeout)
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._token_lock = asyncio.Lock()
+        return self._client, self._slots, self._token_lock
+
+    async def __access_token(self, rejected_token=None):
+        # rejected_token: the token that was rejected by the server (401);
+        # it is only replaced if no other task replaced it already
+        if rejected_token is None and self._token is not None and \
+                time.monotonic() < self._refresh_at:
+            return self._token
+        client, _, lock = self.__loop_state()
+        async with lock:
+            if self._token is None or self._token == rejected_token or \
+                    time.monotonic() >= self._refresh_at:
+                response = await client.post(
+                    self._base_url + self._token_path,
+                    data={'client_id': self._client_id,
+                          'client_secret': self._client_secret,
+                          'grant_type': 'client_credentials'})
+                rd = json.loads(response.content)
+                if 'error' in rd:
+                    raise NameError('error ' + rd['error'] + '\n'
+                                    + rd['error_description'])
+                expires_in = float(rd.get('expires_in', 18000))
+                self._token = rd['access_token']
+                self._refresh_at = time.monotonic() + max(
+                    expires_in - self.refresh_margin, expires_in / 2)
+                logging.info('Castor access token fetched, valid for ' +
+                             str(expires_in) + ' seconds')
+        return self._token
+
+    def __should_retry(self, method, response, error):
+        # as RetryPolicy.should_retry, for the errors of httpx
+        if error is None:
+            return self.retry.should_retry(method, response)
+        if method == 'GET' or self.retry.retry_post:
+            return True
+        # only when the request was not sent
+        return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+    async def __send(self, method, request_uri, headers=None, **kwargs):
+        # as CastorApi.__send: with the access token, a new token when it
+        # is rejected (401) and retries of transient errors
+        client, slots, _ = self.__loop_state()
+        token = await self.__access_token()
+        token_refreshed = False
+        attempt = 0
+        while True:
+            request_headers = dict(headers or {})
+            request_headers['Authorization'] = 'Bearer ' + token
+            response = None
+            error = None
+            self.counters['requests'] += 1
+            async with slots:
+                try:
+                    response = await client.request(
+                        method, request_uri, headers=request_headers,
+                        **kwargs)
+                except httpx.TransportError as err:
+                    error = err
+            if response is not None and response.status_code == 401 and \
+                    not token_refreshed:
+                logging.info('Access token rejected, fetching a new token')
+                token = await self.__access_token(rejected_token=token)
+                token_refreshed = True
+                continue
+            if attempt < self.retry.max_retries and \
+                    self.__should_retry(method, response, error):
+                delay = self.retry.delay(attempt, response)
+                logging.info('Retrying ' + method + ' ' + request_uri +
+                             ' in ' + str(round(delay, 2)) + ' seconds (' +
+                             (str(error) if error is not None else
+                              str(response.status_code)) + ')')
+                self.counters['retries'] += 1
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            if error is not None:
+                logging.warning('Error Connecting: %s', error)
+                raise NameError('error with api request (' + request_uri +
+                                '): no response')
+            if response.is_error:
+                logging.warning('Http Error: %s %s', response.status_code,
+                                request_uri)
+                raise NameError('error with api request (' + request_uri +
+                                '): ' + response.text)
+            return response
+
+    def __json(self, response):
+        # see CastorApi.__json
+        encoding = (response.encoding or 'utf-8').lower().replace('_', '-')
+        if encoding in ['utf-8', 'utf8', 'ascii', 'us-ascii']:
+            return self.json_decoder(response.content)
+        return self.json_decoder(response.text)
+
+    async def __json_pages(self, request, page_size=None):
+        # yields the pages of a (paginated) response one by one, with at
+        # most page_workers pages requested ahead (see
+        # CastorApi.__request_json_iter)
+        if page_size:
+            request = _add_query_parameter(request, 'page_size', page_size)
+        rd = self.__json(await self.__send(
+            'GET', self._base_url + self._api_request_path + request))
+        yield rd
+        if 'page' in rd and '_embedded' in rd and \
+                rd['page'] < rd['page_count'] and 'next' in rd['_links']:
+            request_uris = _page_uris(rd['_links']['next']['href'],
+                                      rd['page'], rd['page_count'])
+            workers = max(1, self.page_workers)
+            tasks = deque()
+            try:
+                for request_uri in request_uris:
+                    tasks.append(asyncio.ensure_future(
+                        self.__send('GET', request_uri)))
+                    if len(tasks) >= workers:
+                        yield self.__json(await tasks.popleft())
+                while tasks:
+                    yield self.__json(await tasks.popleft())
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    async def __respond(self, request):
+        # send a request of a _RequestPlan
+        kind, path, parameter = request
+        request_uri = self._base_url + self._api_request_path + path
+        if kind == 'GET':
+            return await self.__send('GET', request_uri)
+        if kind == 'POST':
+            rd = self.__json(await self.__send(
+                'POST', request_uri,
+                headers={'content-type': 'application/json'},
+                content=json.dumps(parameter)))
+            if 'page' in rd and '_embedded' in rd:
+                raise NameError('Did not expect pagination for result of '
+                                + 'POST.')
+            return rd
+        pages = [rd async for rd in self.__json_pages(path, parameter)]
+        if kind == 'PAGES':
+            return pages
+        # pagination: sometimes multiple entries are found; combine these
+        rd = pages[0]
+        for rd2 in pages[1:]:
+            for key in rd2['_embedded'].keys():
+                rd['_embedded'][key] += rd2['_embedded'][key]
+        return rd
+
+    def __plan(self, responses):
+        return _RequestPlan(self.page_size, self.bulk_page_size,
+                            self.__study_id_saved, responses)
+
+    async def _call(self, name, args, kwargs):
+        # run CastorApi.<name> until all of its requests are answered
+        responses = []
+        while True:
+            plan = self.__plan(responses)
+            try:
+                result = getattr(plan, name)(*args, **kwargs)
+            except _Deferred as deferred:
+                responses.append((deferred.request,
+                                  await self.__respond(deferred.request)))
+                continue
+            self.__study_id_saved = plan._CastorApi__study_id_saved
+            return result
+
+    async def _iterate(self, name, args, kwargs):
+        # run the CastorApi.<name> generator for every page as it arrives
+        responses = []
+        while True:
+            plan = self.__plan(responses)
+            try:
+                items = list(getattr(plan, name)(*args, **kwargs))
+            except _Deferred as deferred:
+                request = deferred.request
+                if request[0] == 'PAGES':
+                    break
+                responses.append((request, await self.__respond(request)))
+                continue
+            for item in items:
+                yield item
+            return
+        self.__study_id_saved = plan._CastorApi__study_id_saved
+        async for rd in self.__json_pages(request[1], request[2]):
+            plan = self.__plan(responses + [(request, [rd])])
+            for item in getattr(plan, name)(*args, **kwargs):
+                yield item
+
+    async def close(self):
+        # close the connections of the running event loop
+        client = self._client
+        if client is not None and \
+                self._loop is asyncio.get_running_loop():
+            self._loop = self._client = None
+            await client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+def _async_method(name):
+    method = getattr(CastorApi, name)
+
+    @functools.wraps(method)
+    async def coroutine(self, *args, **kwargs):
+        return await self._call(name, args, kwargs)
+    return coroutine
+
+
+def _async_iterator(name):
+    method = getattr(CastorApi, name)
+
+    @functools.wraps(method)
+    def iterator(self, *args, **kwargs):
+        return self._iterate(name, args, kwargs)
+    return iterator
+
+
+# the CastorApi methods of AsyncCastorApi: all their requests go through
+# __request_get, __request_json_get, __request_json_iter and
+# __request_json_post (see _RequestPlan)
+for _name in dir(CastorApi):
+    if _name.startswith('request_') or _name == 'select_study_by_name':
+        setattr(AsyncCastorApi, _name, _async_method(_name))
+for _name in ['iter_study_records', 'iter_datapointcollection']:
+    setattr(AsyncCastorApi, _name, _async_iterator(_name))
+del _name
+
 
 if __name__ == "__main__":
     print('\n# USAGE of CastorApi:\n')
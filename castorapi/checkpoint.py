@@ -0,0 +1,74 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+class RecordCheckpoint:
+    """Data points per record of an export in progress, stored in sqlite.
+
+    USAGE:
+    c.records_reports_all(checkpoint_file='/path/to/export.sqlite')
+
+    Each record is committed as soon as its data points are fetched. When
+    the export is interrupted (e.g. by a network error), calling it again
+    with the same checkpoint_file skips the records that were already
+    fetched. See CastorApi.records_reports_all.
+
+    NOTE:
+    # The checkpoint contains study data; store it in a private folder.
+    """
+
+    def __init__(self, path, study_id):
+        self.path = path
+        self.study_id = study_id
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoint (study_id TEXT)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS records (record_id TEXT PRIMARY '
+                'KEY, study_data TEXT, report_data TEXT)')
+            row = self._connection.execute(
+                'SELECT study_id FROM checkpoint').fetchone()
+            if row is None:
+                self._connection.execute(
+                    'INSERT INTO checkpoint (study_id) VALUES (?)',
+                    (study_id,))
+        if row is not None and row[0] != study_id:
+            self.close()
+            raise NameError('checkpoint ' + path + ' belongs to study '
+                            + row[0] + ', not to study ' + study_id)
+
+    def record_ids(self):
+        # the records that are stored in the checkpoint
+        with self._lock:
+            return set(row[0] for row in self._connection.execute(
+                'SELECT record_id FROM records'))
+
+    def save(self, record_id, study_data, report_data):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO records '
+                '(record_id, study_data, report_data) VALUES (?, ?, ?)',
+                (record_id, json.dumps(study_data), json.dumps(report_data)))
+
+    def load(self, record_id):
+        # (study data, report data) of a record
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT study_data, report_data FROM records '
+                'WHERE record_id = ?', (record_id,)).fetchone()
+        if row is None:
+            raise NameError('record ' + record_id + ' is not in checkpoint '
+                            + self.path)
+        return json.loads(row[0]), json.loads(row[1])
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
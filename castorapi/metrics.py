@@ -0,0 +1,208 @@
+import threading
+
+
+class RequestMetrics:
+    """Request counts, latency histograms and bytes per endpoint.
+
+    USAGE:
+    from castorapi.metrics import RequestMetrics
+    metrics = RequestMetrics()
+    c = CastorApi('/path/to/folder/with/secret_client', hooks=[metrics])
+    c.records_reports_all()
+    metrics.summary()  # dict per endpoint, e.g. 'GET /study/{id}/record'
+    print(metrics.prometheus())  # Prometheus text exposition format
+
+    NOTE:
+    # Every attempt of a request is counted, so retries and requests that
+      were repeated with a new access token are included. Responses from
+      the cache (see castorapi.cache) are counted as cache_hits only.
+    # The latency of a streamed request (e.g. the study export) is the time
+      until the response headers arrived.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.,
+               30., 60.)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        key = (event['method'], event['endpoint'])
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = {
+                    'requests': 0, 'errors': 0, 'retries': 0,
+                    'cache_hits': 0, 'not_modified': 0, 'seconds': 0.,
+                    'max_seconds': 0., 'bytes_sent': 0, 'bytes_received': 0,
+                    'statuses': {},
+                    'buckets': [0] * (len(self.buckets) + 1)}
+            if event['cache_hit']:
+                stats['cache_hits'] += 1
+                return
+            status = event['status']
+            stats['requests'] += 1
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            if status is None or status >= 400:
+                stats['errors'] += 1
+            if status == 304:
+                stats['not_modified'] += 1
+            if event['attempt'] > 0:
+                stats['retries'] += 1
+            seconds = event['seconds']
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['bytes_sent'] += event['bytes_sent']
+            stats['bytes_received'] += event['bytes_received']
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    break
+            else:
+                i = len(self.buckets)
+            stats['buckets'][i] += 1
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def __quantile(self, stats, q):
+        # upper bound of the histogram bucket that holds quantile q
+        rank = q * stats['requests']
+        count = 0
+        for bound, n in zip(self.buckets, stats['buckets']):
+            count += n
+            if count >= rank:
+                return bound
+        return stats['max_seconds']
+
+    def summary(self):
+        """Summary of all requests, in total and per endpoint.
+
+        Returns
+        -------
+        dict
+            with the totals (requests, errors, retries, cache_hits,
+            not_modified, seconds, bytes_sent, bytes_received) and under
+            'endpoints' these totals per '<METHOD> <endpoint>', with the
+            mean, p50, p95 and max latency in seconds and the count per
+            HTTP status (None: no response).
+        """
+        totals = {'requests': 0, 'errors': 0, 'retries': 0, 'cache_hits': 0,
+                  'not_modified': 0, 'seconds': 0., 'bytes_sent': 0,
+                  'bytes_received': 0}
+        endpoints = {}
+        with self._lock:
+            for (method, endpoint), stats in sorted(
+                    self._endpoints.items()):
+                summary = {key: stats[key] for key in totals}
+                summary['mean_seconds'] = \
+                    stats['seconds'] / stats['requests'] \
+                    if stats['requests'] else None
+                summary['p50_seconds'] = self.__quantile(stats, .5) \
+                    if stats['requests'] else None
+                summary['p95_seconds'] = self.__quantile(stats, .95) \
+                    if stats['requests'] else None
+                summary['max_seconds'] = stats['max_seconds']
+                summary['statuses'] = dict(stats['statuses'])
+                endpoints[method + ' ' + endpoint] = summary
+                for key in totals:
+                    totals[key] += stats[key]
+        totals['endpoints'] = endpoints
+        return totals
+
+    def prometheus(self, prefix='castorapi'):
+        """The metrics in the Prometheus text exposition format.
+
+        Parameters
+        ----------
+        prefix : str
+            prefix of the metric names
+
+        Returns
+        -------
+        str
+            a request duration histogram and counters for requests, errors,
+            retries, cache hits and bytes, labelled by method and endpoint
+        """
+        counters = [('requests_total', 'requests', 'Requests sent'),
+                    ('request_errors_total', 'errors',
+                     'Requests with an error or HTTP status >= 400'),
+                    ('request_retries_total', 'retries', 'Retried requests'),
+                    ('cache_hits_total', 'cache_hits',
+                     'Requests answered from the cache'),
+                    ('bytes_sent_total', 'bytes_sent', 'Request body bytes'),
+                    ('bytes_received_total', 'bytes_received',
+                     'Response body bytes')]
+        with self._lock:
+            items = sorted((key, dict(stats, buckets=list(stats['buckets'])))
+                           for key, stats in self._endpoints.items())
+        lines = []
+        name = prefix + '_request_duration_seconds'
+        lines.append('# HELP ' + name + ' Duration of the requests')
+        lines.append('# TYPE ' + name + ' histogram')
+        for (method, endpoint), stats in items:
+            labels = 'method="' + method + '",endpoint="' + endpoint + '"'
+            count = 0
+            for bound, n in zip(self.buckets, stats['buckets']):
+                count += n
+                lines.append(name + '_bucket{' + labels + ',le="' +
+                             repr(float(bound)) + '"} ' + str(count))
+            lines.append(name + '_bucket{' + labels + ',le="+Inf"} ' +
+                         str(stats['requests']))
+            lines.append(name + '_sum{' + labels + '} ' +
+                         repr(stats['seconds']))
+            lines.append(name + '_count{' + labels + '} ' +
+                         str(stats['requests']))
+        for suffix, key, description in counters:
+            name = prefix + '_' + suffix
+            lines.append('# HELP ' + name + ' ' + description)
+            lines.append('# TYPE ' + name + ' counter')
+            for (method, endpoint), stats in items:
+                lines.append(name + '{method="' + method + '",endpoint="' +
+                             endpoint + '"} ' + str(stats[key]))
+        return '\n'.join(lines) + '\n'
+
+
+class OpenTelemetryHook:
+    """Records every request as an OpenTelemetry span.
+
+    USAGE:
+    from castorapi.metrics import OpenTelemetryHook
+    c = CastorApi('/path/to/folder/with/secret_client',
+                  hooks=[OpenTelemetryHook()])
+
+    Requires the opentelemetry-api package (pip install opentelemetry-api)
+    and a configured tracer provider (opentelemetry-sdk) to export the spans.
+    """
+
+    def __init__(self, tracer=None):
+        if tracer is None:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                raise ImportError('OpenTelemetryHook requires the '
+                                  + 'opentelemetry-api package')
+            tracer = trace.get_tracer('castorapi')
+        self.tracer = tracer
+
+    def __call__(self, event):
+        start = int(event['start'] * 1e9)
+        attributes = {'http.request.method': event['method'],
+                      'url.full': event['uri'],
+                      'url.template': event['endpoint'],
+                      'castorapi.attempt': event['attempt'],
+                      'castorapi.cache_hit': event['cache_hit'],
+                      'http.request.body.size': event['bytes_sent'],
+                      'http.response.body.size': event['bytes_received']}
+        if event['status'] is not None:
+            attributes['http.response.status_code'] = event['status']
+        if event['error'] is not None:
+            attributes['error.type'] = type(event['error']).__name__
+        elif event['status'] is not None and event['status'] >= 400:
+            attributes['error.type'] = str(event['status'])
+        span = self.tracer.start_span(
+            event['method'] + ' ' + event['endpoint'], start_time=start,
+            attributes=attributes)
+        span.end(end_time=start + int(event['seconds'] * 1e9))
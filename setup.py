@@ -20,6 +20,11 @@ setup(
         'requests>=2.23',
         'progressbar2>=3.5'
     ],
+    extras_require={
+        'arrow': ['pyarrow>=8'],
+        'fast': ['orjson'],
+        'async': ['httpx'],
+    },
     long_description=open('README.md').read(),
     classifiers=[
         # Chose either "3 - Alpha", "4 - Beta" or "5 - Production/Stable"
@@ -0,0 +1,468 @@
+"""Local stand-in for the Castor EDC API, for offline tests and benchmarks.
+
+USAGE:
+from mock_castor import MockStudy, MockCastorServer
+with MockCastorServer(MockStudy(n_records=1000, n_fields=50),
+                      latency=0.01, page_size=25) as server:
+    c = CastorApi(client_id='id', client_secret='secret',
+                  base_url=server.url)
+    c.records_reports_all(server.study.study_id)
+    print(server.request_count)
+
+The server mimics the HAL/json shapes (_embedded, _links, pagination) and
+the csv exports of the endpoints that CastorApi uses, for one synthetic
+study. It can add latency, random server errors (error_rate) and expiring
+access tokens (token_expires_in).
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIELD_TYPES = ['numeric', 'string', 'radio', 'date']
+
+STRUCTURE_COLUMNS = ['Study ID', 'Form Type', 'Form Collection ID',
+                     'Form Collection Name', 'Form Collection Order',
+                     'Form ID', 'Form Name', 'Form Order', 'Field ID',
+                     'Field Variable Name', 'Field Label', 'Field Type',
+                     'Field Order', 'Field Required', 'Calculation Template',
+                     'Field Option Group']
+OPTIONGROUP_COLUMNS = ['Study ID', 'Option Group Id', 'Option Group Name',
+                       'Option Id', 'Option Name', 'Option Value']
+DATA_COLUMNS = ['Study ID', 'Record ID', 'Form Type', 'Form Instance ID',
+                'Form Instance Name', 'Field ID', 'Value', 'Date', 'User ID']
+
+
+def _links(href):
+    return {'self': {'href': href}}
+
+
+class MockStudy:
+    """Synthetic study: n_records records with values for (about
+    fill_rate of) n_fields study fields, and up to max_report_instances
+    report instances per record with n_report_fields fields each."""
+
+    def __init__(self, n_records=100, n_fields=10, n_report_fields=3,
+                 max_report_instances=2, n_institutes=3, fill_rate=0.9,
+                 study_id='MOCK-STUDY-0001', seed=0):
+        rng = random.Random(seed)
+        self.study_id = study_id
+        self.name = 'Mock study'
+        self.optiongroup = {'id': 'OG-YESNO', 'name': 'Yes/no',
+                            'options': [{'id': 'OPT-0', 'name': 'No',
+                                         'value': '0'},
+                                        {'id': 'OPT-1', 'name': 'Yes',
+                                         'value': '1'}]}
+        self.institutes = [{'id': 'INST-%02d' % i, 'name': 'Institute %d' % i,
+                            'abbreviation': 'I%d' % i}
+                           for i in range(n_institutes)]
+        self.fields = [self._field('F%05d' % i, 'var_%d' % i,
+                                   FIELD_TYPES[i % len(FIELD_TYPES)],
+                                   'STEP-STUDY') for i in range(n_fields)]
+        self.report_fields = [self._field('R%05d' % i, 'rep_%d' % i,
+                                          FIELD_TYPES[i % len(FIELD_TYPES)],
+                                          'STEP-REPORT')
+                              for i in range(n_report_fields)]
+        self.records = []
+        self.study_points = {}
+        self.report_points = {}
+        for i in range(n_records):
+            record_id = '%06d' % (i + 1)
+            institute = self.institutes[i % n_institutes]
+            self.records.append({
+                'id': record_id, 'record_id': record_id,
+                'ccr_patient_id': '', 'archived': False,
+                'updated_on': {'date': '2020-01-01 00:00:00.000000',
+                               'timezone_type': 3, 'timezone': 'UTC'},
+                '_embedded': {'institute': institute},
+                '_links': _links('/record/' + record_id)})
+            self.study_points[record_id] = [
+                self._point(record_id, field, self._value(rng, field))
+                for field in self.fields if rng.random() < fill_rate]
+            self.report_points[record_id] = [
+                dict(self._point(record_id, field, self._value(rng, field)),
+                     report_instance_id='RI-%s-%d' % (record_id, k))
+                for k in range(rng.randint(0, max_report_instances))
+                for field in self.report_fields]
+        self.lock = threading.Lock()
+
+    def _field(self, field_id, name, field_type, parent_id):
+        return {'field_id': field_id, 'id': field_id,
+                'field_variable_name': name, 'field_type': field_type,
+                'field_label': name, 'parent_id': parent_id,
+                'option_group': ({'id': self.optiongroup['id'],
+                                  'name': self.optiongroup['name']}
+                                 if field_type == 'radio' else None),
+                '_links': _links('/field/' + field_id)}
+
+    def _point(self, record_id, field, value):
+        return {'record_id': record_id, 'field_id': field['field_id'],
+                'field_value': value,
+                '_links': _links('/record/' + record_id + '/data-point/' +
+                                 field['field_id'])}
+
+    @staticmethod
+    def _value(rng, field):
+        if field['field_type'] == 'numeric':
+            return str(rng.randint(1, 200))
+        if field['field_type'] == 'radio':
+            return rng.choice(['0', '1'])
+        if field['field_type'] == 'date':
+            return '%02d-%02d-20%02d' % (rng.randint(1, 28),
+                                         rng.randint(1, 12),
+                                         rng.randint(0, 20))
+        return 'text %d' % rng.randint(0, 10 ** 6)
+
+    def touch(self, record_id, field_id, value):
+        # change (or add) a study data point and update the record
+        with self.lock:
+            points = self.study_points[record_id]
+            for point in points:
+                if point['field_id'] == field_id:
+                    point['field_value'] = value
+                    break
+            else:
+                field = [f for f in self.fields if f['field_id'] == field_id]
+                points.append(self._point(record_id, field[0], value))
+            record = [r for r in self.records if r['record_id'] == record_id]
+            record[0]['updated_on'] = dict(record[0]['updated_on'],
+                                           date=time.strftime(
+                                               '%Y-%m-%d %H:%M:%S.000000'),
+                                           counter=time.time())
+
+    def structure_csv(self):
+        rows = [STRUCTURE_COLUMNS]
+        for form_type, fields, form in [('Study', self.fields, 'Baseline'),
+                                        ('Report', self.report_fields,
+                                         'Adverse event')]:
+            for order, field in enumerate(fields):
+                rows.append([self.study_id, form_type, 'PHASE-' + form_type,
+                             form, '1', field['parent_id'], form, '1',
+                             field['field_id'],
+                             field['field_variable_name'],
+                             field['field_label'], field['field_type'],
+                             str(order + 1), '0', '',
+                             field['option_group']['id']
+                             if field['option_group'] else ''])
+        return _csv(rows)
+
+    def optiongroups_csv(self):
+        rows = [OPTIONGROUP_COLUMNS]
+        for option in self.optiongroup['options']:
+            rows.append([self.study_id, self.optiongroup['id'],
+                         self.optiongroup['name'], option['id'],
+                         option['name'], option['value']])
+        return _csv(rows)
+
+    def data_csv(self):
+        rows = [DATA_COLUMNS]
+        for record in self.records:
+            record_id = record['record_id']
+            for point in self.study_points[record_id]:
+                rows.append([self.study_id, record_id, 'Study', '', '',
+                             point['field_id'], point['field_value'],
+                             '01-01-2020 00:00:00', 'USER-1'])
+            for point in self.report_points[record_id]:
+                rows.append([self.study_id, record_id, 'Report',
+                             point['report_instance_id'], 'Adverse event',
+                             point['field_id'], point['field_value'],
+                             '01-01-2020 00:00:00', 'USER-1'])
+        return _csv(rows)
+
+
+def _csv(rows):
+    return ''.join(';'.join('"' + value.replace('"', '""') + '"'
+                            if ';' in value or '"' in value else value
+                            for value in row) + '\n' for row in rows)
+
+
+class MockCastorServer:
+    """Serves a MockStudy on a local port (in a background thread).
+
+    latency: seconds added to every api request
+    page_size: default page size of paginated responses
+    error_rate: fraction of api requests answered with error_status
+    drop_next: number of next api POST requests whose connection is closed
+        after the request was read, without a response
+    token_expires_in: lifetime (seconds) of the access tokens
+    max_in_flight: highest number of api GET requests that were handled at
+        the same time
+    """
+
+    def __init__(self, study=None, latency=0., page_size=25, error_rate=0.,
+                 error_status=500, token_expires_in=18000, seed=0):
+        self.study = study if study is not None else MockStudy()
+        self.latency = latency
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token_expires_in = token_expires_in
+        self.request_count = 0
+        self.route_counts = {}
+        self.bytes_sent = 0
+        self.tokens = []
+        self.valid_tokens = set()
+        self.fail_next = []  # statuses for the next api requests
+        self.fail_paths = {}  # status per path suffix, until removed
+        self.drop_next = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                           _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            self.request_count = 0
+            self.route_counts = {}
+            self.max_in_flight = 0
+            self.bytes_sent = 0
+
+    def revoke_tokens(self):
+        with self._lock:
+            self.valid_tokens.clear()
+
+    def _count(self, route, size):
+        with self._lock:
+            self.request_count += 1
+            self.route_counts[route] = self.route_counts.get(route, 0) + 1
+            self.bytes_sent += size
+
+    def _error(self, path=''):
+        with self._lock:
+            for suffix, status in self.fail_paths.items():
+                if path.endswith(suffix):
+                    return status
+            if self.fail_next:
+                return self.fail_next.pop(0)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self.error_status
+        return None
+
+
+def _make_handler(server):
+    study = server.study
+    prefix = '/api/study/' + study.study_id
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type='application/hal+json',
+                  route=None, headers=None):
+            if not isinstance(body, (bytes, str)):
+                body = json.dumps(body)
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            if status == 200 and self.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+            self.send_response(status)
+            self.send_header('Content-Type',
+                             content_type + '; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            if status in (200, 304):
+                self.send_header('ETag', etag)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            # count before the client can receive the response
+            server._count(route or self.path.split('?')[0], len(body))
+            self.wfile.write(body)
+
+        def _page(self, path, query, key, items):
+            page_size = int(query.get('page_size', [server.page_size])[0])
+            page = int(query.get('page', ['1'])[0])
+            page_count = max(1, -(-len(items) // page_size))
+            base = server.url + path
+            links = {}
+            for name, number in [('self', page), ('first', 1),
+                                 ('last', page_count), ('next', page + 1),
+                                 ('prev', page - 1)]:
+                if 1 <= number <= page_count:
+                    params = dict((k, v[0]) for k, v in query.items())
+                    params.update(page=number, page_size=page_size)
+                    links[name] = {'href': base + '?' +
+                                   urllib.parse.urlencode(params)}
+            return {'_links': links,
+                    '_embedded': {key: items[(page - 1) * page_size:
+                                             page * page_size]},
+                    'page_count': page_count, 'page_size': page_size,
+                    'total_items': len(items), 'page': page}
+
+        def _authorized(self):
+            token = self.headers.get('Authorization', '')[len('Bearer '):]
+            return token in server.valid_tokens
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return self.rfile.read(length) if length else b''
+
+        def do_POST(self):
+            body = self._body()
+            if self.path == '/oauth/token':
+                with server._lock:
+                    token = 'token-%d' % len(server.tokens)
+                    server.tokens.append(token)
+                    server.valid_tokens.add(token)
+                return self._send(200, {
+                    'access_token': token, 'token_type': 'Bearer',
+                    'expires_in': server.token_expires_in},
+                    content_type='application/json')
+            if not self._authorized():
+                return self._send(401, {'detail': 'Invalid token'})
+            with server._lock:
+                drop = server.drop_next > 0
+                server.drop_next -= drop
+            if drop:
+                # the request was received, but the connection is lost
+                server._count('POST dropped', 0)
+                self.close_connection = True
+                return
+            path = urllib.parse.urlparse(self.path).path
+            match = re.match(re.escape(prefix) + r'/record/([^/]+)/'
+                             r'data-point-collection/(study|report-instance)'
+                             r'(/[^/]+)?$', path)
+            if match and match.group(1) in study.study_points:
+                data = json.loads(body.decode('utf-8'))['data']
+                success = []
+                failed = []
+                field_ids = [f['field_id'] for f in study.fields]
+                for item in data:
+                    if match.group(2) == 'study' and \
+                            item['field_id'] in field_ids:
+                        study.touch(match.group(1), item['field_id'],
+                                    item['field_value'])
+                        success.append(item)
+                    else:
+                        failed.append(dict(item, code='ERR_UNKNOWN_FIELD'))
+                return self._send(201, {'total_processed': len(data),
+                                        'success': success,
+                                        'failed': failed},
+                                  route='POST data-point-collection')
+            self._send(404, {'detail': 'Not found'})
+
+        def do_GET(self):
+            with server._lock:
+                server.in_flight += 1
+                server.max_in_flight = max(server.max_in_flight,
+                                           server.in_flight)
+            try:
+                self._get()
+            finally:
+                with server._lock:
+                    server.in_flight -= 1
+
+        def _get(self):
+            if server.latency:
+                time.sleep(server.latency)
+            if not self._authorized():
+                return self._send(401, {'detail': 'Invalid token'})
+            status = server._error(self.path.split('?')[0])
+            if status:
+                headers = {'Retry-After': '0'} if status == 429 else {}
+                return self._send(status, {'detail': 'Mock error'},
+                                  headers=headers)
+            url = urllib.parse.urlparse(self.path)
+            path = url.path
+            query = urllib.parse.parse_qs(url.query)
+            if path == '/api/user':
+                return self._send(200, {'_embedded': {'user': [
+                    {'id': 'USER-1', 'full_name': 'Mock User'}]}})
+            if path == '/api/study':
+                return self._send(200, {'_embedded': {'study': [
+                    {'study_id': study.study_id, 'name': study.name}]}})
+            if not path.startswith(prefix):
+                return self._send(404, {'detail': 'Not found'})
+            rest = path[len(prefix):]
+            if rest == '':
+                return self._send(200, {'study_id': study.study_id,
+                                        'name': study.name})
+            if rest == '/record':
+                return self._send(200, self._page(path, query, 'records',
+                                                  study.records),
+                                  route='/record')
+            if rest == '/record-progress/steps':
+                return self._send(200, self._page(path, query, 'records', [
+                    {'record_id': r['record_id'],
+                     'steps': [{'step_id': 'STEP-STUDY',
+                                'complete': len(study.study_points[
+                                    r['record_id']])}]}
+                    for r in study.records]), route='/record-progress')
+            if rest == '/field':
+                return self._send(200, self._page(
+                    path, query, 'fields',
+                    study.fields + study.report_fields), route='/field')
+            if rest == '/institute':
+                return self._send(200, self._page(path, query, 'institutes',
+                                                  study.institutes),
+                                  route='/institute')
+            if rest == '/export/structure':
+                return self._send(200, study.structure_csv(), 'text/csv')
+            if rest == '/export/optiongroups':
+                return self._send(200, study.optiongroups_csv(), 'text/csv')
+            if rest == '/export/data':
+                return self._send(200, study.data_csv(), 'text/csv')
+            if rest == '/data-point-collection/study':
+                return self._send(200, self._page(path, query, 'items', [
+                    p for r in study.records
+                    for p in study.study_points[r['record_id']]]),
+                    route='/data-point-collection/study')
+            if rest == '/data-point-collection/report-instance':
+                return self._send(200, self._page(path, query, 'items', [
+                    p for r in study.records
+                    for p in study.report_points[r['record_id']]]),
+                    route='/data-point-collection/report-instance')
+            match = re.match(r'/record/([^/]+)/data-point-collection/'
+                             r'(study|report-instance)$', rest)
+            if match and match.group(1) in study.study_points:
+                points = study.study_points if match.group(2) == 'study' \
+                    else study.report_points
+                return self._send(200, self._page(path, query, 'items',
+                                                  points[match.group(1)]),
+                                  route='/record/{id}/data-point-collection/'
+                                  + match.group(2))
+            match = re.match(r'/record/([^/]+)/study-data-point/([^/]+)$',
+                             rest)
+            if match and match.group(1) in study.study_points:
+                points = [p for p in study.study_points[match.group(1)]
+                          if p['field_id'] == match.group(2)]
+                if points:
+                    return self._send(200, {
+                        'record_id': match.group(1),
+                        'field_id': match.group(2),
+                        'value': points[0]['field_value']},
+                        route='/record/{id}/study-data-point/{id}')
+            self._send(404, {'detail': 'Not found'})
+
+    return Handler
@@ -0,0 +1,419 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import requests
+from castorapi.castorapi import AsyncCastorApi, CastorApi, RetryPolicy
+from castorapi.cache import MemoryCache
+from castorapi.metrics import RequestMetrics
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_castor import MockStudy, MockCastorServer  # noqa: E402
+
+
+class TestCastorApiMock(unittest.TestCase):
+    '''Testing the CastorApi offline, against a local mock server'''
+
+    def setUp(self):
+        self.server = MockCastorServer(MockStudy(n_records=60, n_fields=8),
+                                       page_size=10).start()
+        self.study_id = self.server.study.study_id
+        self.c = CastorApi(client_id='client', client_secret='secret',
+                           base_url=self.server.url,
+                           retry=RetryPolicy(backoff_factor=0.01))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_pagination(self):
+        records = self.c.request_study_records(self.study_id)
+        self.assertEqual([r['record_id'] for r in records],
+                         [r['record_id'] for r in self.server.study.records])
+        self.assertEqual(self.server.route_counts['/record'], 6)
+
+        # streamed and with a larger page size
+        self.c.page_size = 25
+        self.server.reset_counts()
+        self.assertEqual(list(self.c.iter_study_records(self.study_id)),
+                         records)
+        self.assertEqual(self.server.route_counts['/record'], 3)
+
+    def test_recordsReportsConcurrent(self):
+        serial = self.c.records_reports_all(self.study_id, bulk=False)
+        concurrent = self.c.records_reports_all(self.study_id, max_workers=8,
+                                                bulk=False)
+        for df_serial, df_concurrent in zip(serial, concurrent):
+            self.assertTrue(df_serial.equals(df_concurrent))
+        self.assertEqual(len(serial[0]), 60)
+        self.assertTrue(all([d in serial[0].columns.to_list()
+                             for d in ['Record Id', 'var_0', 'var_7']]))
+
+    def test_recordsReportsBulk(self):
+        options = {'add_including_center': True,
+                   'include_columns_without_data': True, 'typed': True}
+        per_record = self.c.records_reports_all(self.study_id, bulk=False,
+                                                **options)
+        self.server.reset_counts()
+        self.c.bulk_page_size = 100
+        bulk = self.c.records_reports_all(self.study_id, **options)
+        for df_per_record, df_bulk in zip(per_record, bulk):
+            self.assertTrue(df_per_record.equals(df_bulk))
+        self.assertEqual(self.server.route_counts.get(
+            '/record/{id}/data-point-collection/study'), None)
+        # pages of bulk_page_size, not of the (mock) default page size
+        n_points = sum(len(points) for points in
+                       self.server.study.study_points.values())
+        self.assertEqual(self.server.route_counts[
+            '/data-point-collection/study'], -(-n_points // 100))
+
+    def test_iterDatapointcollectionStudyLevel(self):
+        points = list(self.c.iter_datapointcollection(self.study_id))
+        self.assertEqual(points, [p for r in self.server.study.records
+                                  for p in self.server.study.study_points[
+                                      r['record_id']]])
+        self.assertEqual(self.server.route_counts.get(
+            '/record/{id}/data-point-collection/study'), None)
+        self.assertEqual(self.server.route_counts[
+            '/data-point-collection/study'], 1)
+
+    def test_recordsReportsSync(self):
+        with tempfile.TemporaryDirectory() as folder:
+            snapshot = os.path.join(folder, 'snapshot.json')
+            self.c.records_reports_sync(snapshot, self.study_id)
+            self.server.study.touch('000002', 'F00001', '123')
+
+            self.server.reset_counts()
+            synced = self.c.records_reports_sync(snapshot, self.study_id)
+            self.assertEqual(self.server.route_counts[
+                '/record/{id}/data-point-collection/study'], 1)
+        full = self.c.records_reports_all(self.study_id)
+        for df_synced, df_full in zip(synced, full):
+            self.assertTrue(df_synced.equals(df_full))
+        self.assertEqual(synced[0].set_index('Record Id').loc[
+            '000002', 'var_1'], '123')
+
+    def test_recordsReportsCheckpoint(self):
+        full = self.c.records_reports_all(self.study_id)
+        c = CastorApi(client_id='client', client_secret='secret',
+                      base_url=self.server.url,
+                      retry=RetryPolicy(max_retries=0))
+        with tempfile.TemporaryDirectory() as folder:
+            checkpoint = os.path.join(folder, 'checkpoint.sqlite')
+            self.server.fail_next = [None] * 40 + [500]
+            with self.assertRaises(NameError):
+                c.records_reports_all(self.study_id, max_workers=4,
+                                      checkpoint_file=checkpoint)
+            self.assertTrue(os.path.isfile(checkpoint))
+
+            self.server.reset_counts()
+            resumed = c.records_reports_all(self.study_id, max_workers=4,
+                                            checkpoint_file=checkpoint)
+            self.assertFalse(os.path.isfile(checkpoint))
+        fetched = self.server.route_counts[
+            '/record/{id}/data-point-collection/study']
+        self.assertTrue(0 < fetched < 60)
+        for df_resumed, df_full in zip(resumed, full):
+            self.assertTrue(df_resumed.equals(df_full))
+
+    def test_recordsReportsCheckpointKeptOnFrameError(self):
+        c = CastorApi(client_id='client', client_secret='secret',
+                      base_url=self.server.url,
+                      retry=RetryPolicy(max_retries=0))
+        with tempfile.TemporaryDirectory() as folder:
+            checkpoint = os.path.join(folder, 'checkpoint.sqlite')
+            # all records are fetched, then the export structure fails
+            self.server.fail_paths['/export/structure'] = 500
+            with self.assertRaises(NameError):
+                c.records_reports_all(self.study_id,
+                                      checkpoint_file=checkpoint)
+            self.assertEqual(self.server.route_counts[
+                '/record/{id}/data-point-collection/study'], 60)
+            self.assertTrue(os.path.isfile(checkpoint))
+
+            del self.server.fail_paths['/export/structure']
+            self.server.reset_counts()
+            c.records_reports_all(self.study_id, checkpoint_file=checkpoint)
+            self.assertFalse(os.path.isfile(checkpoint))
+        self.assertEqual(self.server.route_counts.get(
+            '/record/{id}/data-point-collection/study'), None)
+
+    @unittest.skipIf(pyarrow is None, 'requires pyarrow')
+    def test_saveRecordsReports(self):
+        frames = self.c.records_reports_all(self.study_id, typed=True,
+                                            add_including_center=True)
+        with tempfile.TemporaryDirectory() as folder:
+            self.c.save_records_reports(folder, self.study_id)
+            df_study = pd.read_parquet(os.path.join(folder, 'study'))
+            self.assertEqual(sorted(os.listdir(os.path.join(folder,
+                                                            'study'))),
+                             ['hospital=Institute%200',
+                              'hospital=Institute%201',
+                              'hospital=Institute%202'])
+        df_study = df_study.sort_values('Record Id').reset_index(drop=True)
+        self.assertEqual(len(df_study), 60)
+        self.assertEqual(df_study['var_2'].dtype, 'category')
+        self.assertTrue(df_study['var_0'].equals(frames[0]['var_0']))
+
+    def test_harvestStudies(self):
+        # the study id saved by the caller and its request budget are kept
+        self.c._CastorApi__study_id_saved = 'SAVED-STUDY'
+        with tempfile.TemporaryDirectory() as folder:
+            summary = self.c.harvest_studies(
+                folder, [self.study_id, 'MISSING-STUDY'],
+                max_concurrent_requests=2)
+            frames = pd.read_pickle(os.path.join(folder,
+                                                 self.study_id + '.pkl'))
+            self.assertTrue(os.path.isfile(os.path.join(folder,
+                                                        'summary.json')))
+        self.assertEqual((summary['succeeded'], summary['failed']), (1, 1))
+        self.assertEqual([s['status'] for s in summary['studies']],
+                         ['ok', 'error'])
+        self.assertEqual(summary['studies'][0]['records'], 60)
+        self.assertEqual(self.c._CastorApi__study_id_saved, 'SAVED-STUDY')
+        self.assertIsNone(self.c._request_slots)
+        self.assertTrue(summary['counters']['requests'] > 0)
+        self.assertTrue(frames[0].equals(
+            self.c.records_reports_all(self.study_id)[0]))
+
+    @unittest.skipIf(httpx is None, 'requires httpx')
+    def test_asyncCastorApi(self):
+        c = AsyncCastorApi(client_id='client', client_secret='secret',
+                           base_url=self.server.url, max_concurrency=4,
+                           retry=RetryPolicy(backoff_factor=0.01))
+        expected = [self.c.request_datapointcollection(
+            self.study_id, record_id=r['record_id'])
+            for r in self.server.study.records]
+
+        def client_threads():
+            # without the threads of the mock server
+            return [t.name for t in threading.enumerate()
+                    if 'process_request' not in t.name]
+
+        async def gather():
+            records = await c.request_study_records(self.study_id)
+            data = await asyncio.gather(*[
+                c.request_datapointcollection(self.study_id,
+                                              record_id=r['record_id'])
+                for r in records])
+            self.assertEqual(client_threads(), threads)
+            return data
+
+        async def iterate():
+            async with c:
+                return [r['record_id'] async for r in
+                        c.iter_study_records(self.study_id)]
+
+        # the requests are sent on the event loop, at most max_concurrency
+        # at a time, and the instance is reused in a second event loop
+        self.server.latency = 0.02
+        self.server.reset_counts()
+        threads = client_threads()
+        self.assertEqual(asyncio.run(gather()), expected)
+        self.assertEqual(self.server.max_in_flight, 4)
+        self.assertEqual(asyncio.run(gather()), expected)
+        self.assertEqual(asyncio.run(iterate()),
+                         [r['record_id'] for r in self.server.study.records])
+        self.assertEqual(self.server.route_counts['/record'], 3 * 6)
+
+        # retries, a new access token and the saved study id
+        self.server.latency = 0
+        self.server.fail_next = [500, 429]
+        self.server.revoke_tokens()
+        self.assertEqual(asyncio.run(c.request_field(self.study_id)),
+                         self.c.request_field(self.study_id))
+        self.assertEqual(c.counters['retries'], 2)
+        self.assertEqual(
+            asyncio.run(c.request_datapointcollection(record_id='000001')),
+            expected[0])
+        self.assertTrue(asyncio.run(c.request_study_export_structure())
+                        .equals(self.c.request_study_export_structure()))
+        self.assertEqual(asyncio.run(c.select_study_by_name(
+            self.server.study.name)), self.study_id)
+        response = asyncio.run(c.request_datapointcollection(
+            record_id='000001', field_id='F00000', field_value='10',
+            request_method='POST'))
+        self.assertEqual(len(response['success']), 1)
+        self.assertEqual(self.server.route_counts[
+            'POST data-point-collection'], 1)
+
+    def test_retryAndToken(self):
+        self.server.fail_next = [500, 503, 429]
+        self.assertEqual(len(self.c.request_study_records(self.study_id)),
+                         60)
+        self.assertEqual(self.c.counters['retries'], 3)
+
+        self.server.revoke_tokens()
+        self.assertEqual(len(self.c.request_field(self.study_id)), 11)
+        self.assertEqual(len(self.server.tokens), 2)
+
+    def test_retryClosesStreamedResponses(self):
+        responses = []
+
+        class Session(requests.Session):
+            def request(self, *args, **kwargs):
+                responses.append(super().request(*args, **kwargs))
+                return responses[-1]
+
+        c = CastorApi(client_id='client', client_secret='secret',
+                      base_url=self.server.url, session=Session(),
+                      retry=RetryPolicy(backoff_factor=0.01))
+        self.server.fail_next = [500, 503]
+        chunks = list(c.iter_study_export_data(self.study_id))
+        self.assertEqual(sum(len(chunk) for chunk in chunks),
+                         len(self.c.request_study_export_data(self.study_id)))
+        retried = [r for r in responses if r.status_code >= 500]
+        self.assertEqual(len(retried), 2)
+        self.assertTrue(all(r.raw.closed for r in retried))
+
+    def test_retryAfterIsCapped(self):
+        retry = RetryPolicy(max_backoff=30.)
+        response = requests.Response()
+        response.headers['Retry-After'] = '3600'
+        self.assertEqual(retry.delay(0, response), 30.)
+        response.headers['Retry-After'] = '2'
+        self.assertEqual(retry.delay(0, response), 2.)
+
+    def test_lazyImports(self):
+        # JSON requests and posting tuples do not import pandas (or
+        # progressbar)
+        code = ('import sys\n'
+                'from castorapi import CastorApi\n'
+                'c = CastorApi(client_id="client", client_secret="secret", '
+                'base_url=%r)\n'
+                'c.request_study_records(%r)\n'
+                'c.post_datapoints([("000001", "F00000", "10")], %r)\n'
+                'print("pandas" in sys.modules, '
+                '"progressbar" in sys.modules)') % (
+                    self.server.url, self.study_id, self.study_id)
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        output = subprocess.run([sys.executable, '-c', code],
+                                env=dict(os.environ, PYTHONPATH=root),
+                                capture_output=True, text=True).stdout
+        self.assertEqual(output.strip(), 'False False')
+
+    def test_coalesce(self):
+        self.server.latency = 0.2
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(
+                lambda _: self.c.request_field(self.study_id), range(8)))
+        self.assertEqual(self.server.route_counts['/field'], 2)
+        self.assertEqual(self.c.counters['coalesced'], 7)
+        self.assertTrue(all([r == results[0] for r in results]))
+        self.assertEqual(len(set(id(r) for r in results)), 8)
+
+    def test_jsonDecoder(self):
+        calls = []
+
+        def decoder(content):
+            calls.append(type(content))
+            return json.loads(content)
+
+        c = CastorApi(client_id='client', client_secret='secret',
+                      base_url=self.server.url, json_decoder=decoder)
+        self.assertEqual(c.request_study_records(self.study_id),
+                         self.c.request_study_records(self.study_id))
+        self.assertEqual(set(calls), {bytes})
+
+    def test_cache(self):
+        self.c.cache = MemoryCache()
+        fields = self.c.request_field(self.study_id)
+        self.server.reset_counts()
+        self.assertEqual(self.c.request_field(self.study_id), fields)
+        self.assertEqual(self.server.request_count, 0)
+
+    def test_metrics(self):
+        metrics = RequestMetrics()
+        self.c.hooks.append(metrics)
+        self.c.cache = MemoryCache()
+        self.server.fail_next = [503]
+        self.c.request_study_records(self.study_id)
+        self.c.request_field(self.study_id)
+        self.c.request_field(self.study_id)
+        summary = metrics.summary()
+        records = summary['endpoints']['GET /study/{id}/record']
+        self.assertEqual(records['requests'], 7)
+        self.assertEqual(records['retries'], 1)
+        self.assertEqual(records['errors'], 1)
+        self.assertEqual(summary['endpoints']['GET /study/{id}/field'][
+            'cache_hits'], 2)
+        self.assertEqual(summary['requests'], self.c.counters['requests'])
+        self.assertTrue(summary['bytes_received'] > 0)
+        self.assertIn('castorapi_request_duration_seconds_count{method="GET"'
+                      + ',endpoint="/study/{id}/record"} 7',
+                      metrics.prometheus())
+
+    def test_exportStreaming(self):
+        data = self.c.request_study_export_data(self.study_id)
+        chunks = list(self.c.iter_study_export_data(self.study_id,
+                                                    chunksize=100))
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(pd.concat(chunks).equals(data))
+
+    def test_fieldValues(self):
+        records = self.c.request_study_records(self.study_id)
+        batched = self.c.field_values_by_variable_name(
+            'var_1', records=records, batched=True)
+        per_record = self.c.field_values_by_variable_name(
+            'var_1', records=records, batched=False)
+        self.assertEqual(batched, per_record)
+        export = self.c.field_values_by_variable_name(
+            'var_1', records=records, batched='export')
+        self.assertEqual(export, per_record)
+
+        # default: the collection (one page of 1000) for 60 records, one
+        # request per record when the collection has more pages
+        self.server.reset_counts()
+        self.assertEqual(self.c.field_values_by_variable_name(
+            'var_1', records=records), per_record)
+        self.assertEqual(self.server.route_counts[
+            '/data-point-collection/study'], 1)
+        self.assertEqual(self.server.route_counts.get('/export/data'), None)
+        self.server.reset_counts()
+        self.c.bulk_page_size = 10
+        self.assertEqual(self.c.field_values_by_variable_name(
+            'var_1', records=records[:5]), per_record[:5])
+        self.assertEqual(self.server.route_counts[
+            '/data-point-collection/study'], 1)
+        self.assertEqual(self.server.route_counts[
+            '/record/{id}/study-data-point/{id}'], 5)
+
+    def test_postDatapoints(self):
+        results = self.c.post_datapoints(
+            [('000001', 'F00000', '10'), ('000001', 'F00001', '11'),
+             ('000002', 'F00000', '12'), ('000002', 'UNKNOWN', '13')],
+            study_id=self.study_id)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(len(results[0]['response']['success']), 2)
+        self.assertEqual(len(results[1]['response']['failed']), 1)
+
+    def test_postNotRetriedAfterDroppedConnection(self):
+        # the server received the POST, so it must not be sent again
+        self.server.drop_next = 1
+        with self.assertRaises(NameError):
+            self.c.request_datapointcollection(
+                self.study_id, record_id='000001', field_id='F00000',
+                field_value='10', request_method='POST')
+        self.assertEqual(self.server.route_counts['POST dropped'], 1)
+        self.assertEqual(self.server.route_counts.get(
+            'POST data-point-collection'), None)
+        self.assertEqual(self.c.counters['retries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
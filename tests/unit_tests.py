@@ -94,6 +94,43 @@ class TestCastorApi(unittest.TestCase):
                 for d in ['Study ID', 'Option Group Id', 'Option Group Name',
                           'Option Id', 'Option Name', 'Option Value']]))
 
+    def test_CastorApi_recordsReportsConcurrent(self):
+        # fetching records concurrently should give the same data as
+        # fetching them one by one
+        serial = self.c.records_reports_all(study_id=self.studyid,
+                                            bulk=False)
+        concurrent = self.c.records_reports_all(study_id=self.studyid,
+                                                max_workers=4,
+                                                max_requests_per_second=20,
+                                                bulk=False)
+        for df_serial, df_concurrent in zip(serial, concurrent):
+            self.assertTrue(df_serial.equals(df_concurrent))
+
+    def test_CastorApi_recordsReportsBulk(self):
+        # the study-level collections should give the same data as
+        # fetching the records one by one
+        per_record = self.c.records_reports_all(study_id=self.studyid,
+                                                bulk=False)
+        bulk = self.c.records_reports_all(study_id=self.studyid)
+        for df_per_record, df_bulk in zip(per_record, bulk):
+            self.assertTrue(df_per_record.equals(df_bulk))
+
+    def test_CastorApi_fieldValuesBatched(self):
+        # values from the export should equal values requested per record
+        self.c.select_study_by_name(self.study_name)
+        records = self.c.request_study_records()
+        batched = self.c.field_values_by_variable_name(
+            'pat_height', records=records, batched=True)
+        per_record = self.c.field_values_by_variable_name(
+            'pat_height', records=records, batched=False)
+        self.assertEqual(batched, per_record)
+
+        values = self.c.field_values_by_variable_names(
+            ['pat_height', 'pat_birth_year'], records=records)
+        self.assertEqual(list(values.columns),
+                         ['pat_height', 'pat_birth_year'])
+        self.assertEqual(len(values), len(records))
+
     def test_CastorApi_statistics0(self):
         self.c.select_study_by_name('test')
         # expect to find 0 results for test study with no entries